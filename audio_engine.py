@@ -0,0 +1,177 @@
+import os
+import audioop
+import asyncio
+import base64
+import threading
+import requests
+import miniaudio
+
+# Twilio media streams carry 8 kHz mono µ-law, one 20 ms frame (160 bytes) per media event
+SAMPLE_RATE = 8000
+FRAME_MS = 20
+FRAME_BYTES = SAMPLE_RATE * FRAME_MS // 1000
+ULAW_SILENCE = b"\xff"
+# How far ahead of real time frames may be sent, so Twilio's buffer never runs dry
+AUDIO_LEAD_MS = int(os.environ.get("AUDIO_LEAD_MS", 200))
+
+GREETING_MP3_URL = "https://files.catbox.moe/tajfjq.mp3"
+CLOSING_MP3_URL = "https://files.catbox.moe/w4f2tu.mp3"
+VOICEMAIL_MP3_URL = "https://files.catbox.moe/0ugvt7.mp3"
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROMPT_DIR = os.path.join(BASE_DIR, "static", "prompts")
+PROMPTS = {
+    "greeting": GREETING_MP3_URL,
+    "closing": CLOSING_MP3_URL,
+    "voicemail": VOICEMAIL_MP3_URL,
+    "greeting_bundled": os.path.join(BASE_DIR, "greeting.mp3"),
+}
+
+MEDIA_EVENT = '{"event":"media","streamSid":"%s","media":{"payload":"%s"}}'
+CLEAR_EVENT = '{"event":"clear","streamSid":"%s"}'
+
+
+def mp3_to_ulaw(mp3_bytes):
+    decoded = miniaudio.decode(mp3_bytes, output_format=miniaudio.SampleFormat.SIGNED16,
+                               nchannels=1, sample_rate=SAMPLE_RATE)
+    return audioop.lin2ulaw(decoded.samples.tobytes(), 2)
+
+
+def encode_frames(ulaw):
+    # Pad the tail with µ-law silence so every frame is exactly 20 ms
+    if len(ulaw) % FRAME_BYTES:
+        ulaw = bytes(ulaw) + ULAW_SILENCE * (FRAME_BYTES - len(ulaw) % FRAME_BYTES)
+    view = memoryview(ulaw)
+    return [base64.b64encode(view[i:i + FRAME_BYTES]).decode()
+            for i in range(0, len(view), FRAME_BYTES)]
+
+
+class PromptCache:
+    """
+    Fixed prompts, transcoded once and kept as base64 µ-law frames. The raw
+    µ-law is also written under static/prompts so restarts and sibling
+    processes skip the download and the decode.
+    """
+
+    def __init__(self, prompts=PROMPTS, cache_dir=PROMPT_DIR):
+        self.prompts = prompts
+        self.cache_dir = cache_dir
+        self.frames = {}
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        return self.frames.get(name)
+
+    def load(self, name, render=None):
+        # render() -> raw µ-law, for audio that is not one of the MP3 prompts.
+        # The download or render runs unlocked so slow prompts load side by
+        # side; two threads racing on one name just both write the same file.
+        frames = self.frames.get(name)
+        if frames is not None:
+            return frames
+        ulaw_path = os.path.join(self.cache_dir, f"{name}.ulaw")
+        if os.path.exists(ulaw_path):
+            with open(ulaw_path, "rb") as f:
+                ulaw = f.read()
+        else:
+            ulaw = render() if render else mp3_to_ulaw(self._fetch(self.prompts[name]))
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{ulaw_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(ulaw)
+            os.replace(tmp_path, ulaw_path)
+        frames = encode_frames(ulaw)
+        with self.lock:
+            return self.frames.setdefault(name, frames)
+
+    def warm(self):
+        for name in self.prompts:
+            try:
+                frames = self.load(name)
+                print(f"[AUDIO] Cached prompt '{name}': {len(frames)} frames")
+            except Exception as e:
+                print(f"[AUDIO] Failed to cache prompt '{name}': {e}")
+
+    def _fetch(self, source):
+        if source.startswith(("http://", "https://")):
+            resp = requests.get(source, timeout=15)
+            resp.raise_for_status()
+            return resp.content
+        with open(source, "rb") as f:
+            return f.read()
+
+
+prompt_cache = PromptCache()
+
+
+class AudioOut:
+    """Per-call µ-law sender: frames audio into 20 ms media events paced in real time."""
+
+    def __init__(self, websocket, stream_sid=None):
+        self.ws = websocket
+        self.stream_sid = stream_sid
+        self.pending = bytearray()
+        self.clock = None
+        self.frames_sent = 0
+        # One-shot hook fired when the next frame goes out (turn timing)
+        self.on_next_frame = None
+
+    async def send_ulaw(self, data):
+        view = memoryview(data)
+        if self.pending:
+            # Complete the partial frame left over from the previous chunk
+            head = FRAME_BYTES - len(self.pending)
+            self.pending += view[:head]
+            view = view[head:]
+            if len(self.pending) < FRAME_BYTES:
+                return
+            payloads = [base64.b64encode(self.pending).decode()]
+            self.pending.clear()
+        else:
+            payloads = []
+        # Whole frames are encoded straight from the caller's buffer (an mmap for cache hits)
+        whole = len(view) - len(view) % FRAME_BYTES
+        payloads += [base64.b64encode(view[i:i + FRAME_BYTES]).decode()
+                     for i in range(0, whole, FRAME_BYTES)]
+        self.pending += view[whole:]
+        for payload in payloads:
+            await self._send_frame(payload)
+
+    async def flush(self):
+        if self.pending:
+            tail = bytes(self.pending) + ULAW_SILENCE * (FRAME_BYTES - len(self.pending))
+            self.pending.clear()
+            await self._send_frame(base64.b64encode(tail).decode())
+
+    async def play_frames(self, payloads):
+        for payload in payloads:
+            await self._send_frame(payload)
+
+    async def play_prompt(self, name):
+        await self.flush()
+        frames = prompt_cache.get(name)
+        if frames is None:
+            # Not warmed at startup: load it once off the event loop
+            frames = await asyncio.get_running_loop().run_in_executor(None, prompt_cache.load, name)
+        await self.play_frames(frames)
+
+    async def clear(self):
+        # Drop anything not yet sent and have Twilio discard what it has buffered
+        self.pending.clear()
+        self.clock = None
+        await self.ws.send(CLEAR_EVENT % self.stream_sid)
+
+    async def _send_frame(self, payload):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self.clock is None or self.clock < now:
+            self.clock = now
+        delay = self.clock - now - AUDIO_LEAD_MS / 1000
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await self.ws.send(MEDIA_EVENT % (self.stream_sid, payload))
+        self.clock += FRAME_MS / 1000
+        self.frames_sent += 1
+        if self.on_next_frame:
+            callback, self.on_next_frame = self.on_next_frame, None
+            callback()
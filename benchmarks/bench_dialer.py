@@ -0,0 +1,169 @@
+"""
+Dialer throughput against a local fake of the Twilio REST API.
+
+    python benchmarks/bench_dialer.py --leads 300 --cps 5 --max-concurrent 15
+
+The fake accepts Calls.json requests, lets each call ring and talk for a
+while, then delivers the final status callback (busy / no-answer / machine /
+completed, drawn at random) straight to dialer.handle_status_callback. The
+run ends once every lead has reached a final state, and reports calls/min,
+queue depth over time, and whether the CPS limit and concurrency cap held.
+
+Uses fakeredis unless --redis-url points at a real server (which it flushes).
+"""
+import os
+import sys
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TWILIO_ACCOUNT_SID", "ACfakefakefakefakefakefakefakefake")
+os.environ.setdefault("TWILIO_AUTH_TOKEN", "fake")
+os.environ.setdefault("TWILIO_FROM_NUMBER", "+15005550006")
+# Retries come due after tens of milliseconds instead of minutes
+os.environ.setdefault("DIALER_RETRY_SCALE", "0.0002")
+os.environ.setdefault("DIALER_REPORT_S", "5")
+
+from aiohttp import web
+import dialer
+
+
+class FakeTwilio:
+    def __init__(self, args, sync_redis):
+        self.args = args
+        self.redis = sync_redis
+        self.outcomes = [(name, float(share)) for name, share in
+                         (item.split("=") for item in args.outcomes.split(","))]
+        self.created = []
+        self.active = 0
+        self.peak_active = 0
+        self.callbacks = set()
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/2010-04-01/Accounts/{account}/Calls.json", self.create_call)
+        return app
+
+    async def create_call(self, request):
+        self.created.append(time.monotonic())
+        form = await request.post()
+        await asyncio.sleep(self.args.api_ms / 1000)
+        self.active += 1
+        self.peak_active = max(self.peak_active, self.active)
+        sid = "CA" + uuid.uuid4().hex
+        task = asyncio.create_task(self.lifecycle(sid))
+        self.callbacks.add(task)
+        task.add_done_callback(self.callbacks.discard)
+        return web.json_response({"sid": sid, "status": "queued", "to": form.get("To"),
+                                  "from": form.get("From")}, status=201)
+
+    async def lifecycle(self, sid):
+        names, weights = zip(*self.outcomes)
+        outcome = random.choices(names, weights)[0]
+        seconds = self.args.ring_s
+        if outcome in ("completed", "machine"):
+            seconds += random.uniform(0.5, 1.5) * self.args.call_s
+        await asyncio.sleep(seconds)
+        values = {"CallSid": sid, "CallStatus": "completed" if outcome == "machine" else outcome}
+        if outcome == "machine":
+            values["AnsweredBy"] = "machine_end_beep"
+        elif outcome == "completed":
+            values["AnsweredBy"] = "human"
+        # The status callback route runs this in a Flask worker thread
+        await asyncio.get_running_loop().run_in_executor(None, dialer.handle_status_callback,
+                                                         self.redis, values)
+        self.active -= 1
+
+    def peak_cps(self):
+        # Most calls created inside any one-second window
+        peak, start = 0, 0
+        for end, t in enumerate(self.created):
+            while t - self.created[start] >= 1.0:
+                start += 1
+            peak = max(peak, end - start + 1)
+        return peak
+
+
+async def run(args):
+    if args.redis_url:
+        import redis
+        import redis.asyncio as aioredis
+        sync_redis = redis.from_url(args.redis_url)
+        async_redis = aioredis.from_url(args.redis_url)
+        await async_redis.flushdb()
+    else:
+        import fakeredis
+        server = fakeredis.FakeServer()
+        sync_redis = fakeredis.FakeRedis(server=server)
+        async_redis = fakeredis.FakeAsyncRedis(server=server)
+
+    fake = FakeTwilio(args, sync_redis)
+    runner = web.AppRunner(fake.app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+
+    os.environ["TWILIO_API_BASE_URL"] = f"http://127.0.0.1:{args.port}"
+    dialer.TWILIO_API_BASE_URL = os.environ["TWILIO_API_BASE_URL"]
+    twilio = dialer.make_twilio_client()
+    d = dialer.Dialer(async_redis, twilio, cps=args.cps, max_concurrent=args.max_concurrent, poll_s=0.05)
+    leads = [(f"+1713555{i:04d}", f"Lead {i}") for i in range(args.leads)]
+    print(f"Queued {await d.enqueue(leads)} leads; CPS {args.cps}, max concurrent {args.max_concurrent}")
+
+    stop = asyncio.Event()
+    started = time.monotonic()
+    dial = asyncio.create_task(d.run(stop))
+    timeline = []
+    while time.monotonic() - started < args.timeout:
+        await asyncio.sleep(1.0)
+        stats = await d.stats()
+        timeline.append((time.monotonic() - started, stats["queued"], stats["active"]))
+        if not stats["queued"] and not stats["active"] and not d.placing and not fake.callbacks:
+            break
+    elapsed = time.monotonic() - started
+    stop.set()
+    await dial
+    await twilio.http_client.close()
+    await runner.cleanup()
+
+    pipe = async_redis.pipeline(transaction=False)
+    for lead_id, _ in leads:
+        pipe.hmget(dialer.LEAD_PREFIX + lead_id, "state", "attempts")
+    rows = await pipe.execute()
+    states = Counter((state or b"?").decode() for state, _ in rows)
+    attempts = sum(int(a or 0) for _, a in rows)
+
+    print()
+    print("  t(s)  queued  in progress")
+    step = max(1, len(timeline) // 12)
+    for t, queued, active in timeline[::step]:
+        print(f"{t:6.1f}  {queued:6d}  {active:11d}")
+    print()
+    print(f"Calls placed:     {len(fake.created)} ({attempts} attempts recorded) in {elapsed:.1f} s")
+    print(f"Throughput:       {len(fake.created) / elapsed * 60:.0f} calls/min "
+          f"(ceiling at {args.cps} CPS: {args.cps * 60:.0f})")
+    print(f"Peak CPS:         {fake.peak_cps()} (limit {args.cps})")
+    print(f"Peak concurrent:  {fake.peak_active} (cap {args.max_concurrent})")
+    print(f"Final states:     {dict(states)}")
+
+
+def main_bench():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--leads", type=int, default=300)
+    parser.add_argument("--cps", type=float, default=5)
+    parser.add_argument("--max-concurrent", type=int, default=15)
+    parser.add_argument("--api-ms", type=float, default=150, help="Calls.json response time")
+    parser.add_argument("--ring-s", type=float, default=0.5)
+    parser.add_argument("--call-s", type=float, default=2.0, help="mean talk time of answered calls")
+    parser.add_argument("--outcomes", default="completed=0.55,busy=0.15,no-answer=0.2,machine=0.1")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--port", type=int, default=18780)
+    parser.add_argument("--redis-url", help="use (and flush) a real Redis instead of fakeredis")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,139 @@
+"""
+Micro-benchmark: the inbound audio path per call-minute, original
+per-frame forwarding (json.loads + b64decode + one ASR message per 20 ms
+frame) versus the ingest stage (payload slicing, batching, silence gating).
+
+    python benchmarks/bench_ingest.py --seconds 60 --talk-share 0.35 --batch-ms 100
+
+Replays synthetic Twilio media events for a call where the caller talks for
+--talk-share of the time. Each ASR message is written to a local socket
+(one send syscall, as a WebSocket frame would be) drained by a thread, so
+the time column includes the per-message send cost.
+"""
+import os
+import sys
+import math
+import time
+import json
+import base64
+import socket
+import random
+import audioop
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ingest
+from ingest import AudioIngest
+
+FRAME_BYTES = 160
+STREAM_SID = "MZ" + "0" * 32
+
+
+def caller_audio(seconds, talk_share, seed=7):
+    # Alternating utterances and pauses with line noise in between
+    rnd = random.Random(seed)
+    frames = []
+    total = int(seconds * 50)
+    while len(frames) < total:
+        talk = int(rnd.uniform(1.0, 4.0) * 50)
+        pause = int(talk * (1 - talk_share) / talk_share)
+        samples = bytearray()
+        for n in range(talk * FRAME_BYTES):
+            value = int((4000 + 2000 * math.sin(n / 900)) * math.sin(2 * math.pi * 180 * n / 8000))
+            samples += value.to_bytes(2, "little", signed=True)
+        speech = audioop.lin2ulaw(bytes(samples), 2)
+        noise = audioop.lin2ulaw(b"".join(rnd.randint(-60, 60).to_bytes(2, "little", signed=True)
+                                          for _ in range(pause * FRAME_BYTES)), 2)
+        for chunk in (speech, noise):
+            frames += [chunk[i:i + FRAME_BYTES] for i in range(0, len(chunk), FRAME_BYTES)]
+    return frames[:total]
+
+
+def twilio_messages(frames):
+    return [json.dumps({"event": "media", "sequenceNumber": str(i + 3),
+                        "media": {"track": "inbound", "chunk": str(i + 1), "timestamp": str(i * 20),
+                                  "payload": base64.b64encode(f).decode()},
+                        "streamSid": STREAM_SID}, separators=(",", ":"))
+            for i, f in enumerate(frames)]
+
+
+class AsrSocket:
+    """Stand-in for the AssemblyAI connection: a socket drained by a thread."""
+
+    def __init__(self):
+        self.tx, self.rx = socket.socketpair()
+        self.reader = threading.Thread(target=self._drain, daemon=True)
+        self.reader.start()
+        self.sent = 0
+        self.sent_bytes = 0
+
+    def send(self, data):
+        self.tx.sendall(data)
+        self.sent += 1
+        self.sent_bytes += len(data)
+
+    def _drain(self):
+        while self.rx.recv(65536):
+            pass
+
+    def close(self):
+        self.tx.close()
+        self.reader.join()
+        self.rx.close()
+
+
+def run_legacy(messages):
+    asr = AsrSocket()
+    started = time.perf_counter()
+    for message in messages:
+        msg = json.loads(message)
+        if msg["event"] == "media":
+            asr.send(base64.b64decode(msg["media"]["payload"]))
+    elapsed = time.perf_counter() - started
+    asr.close()
+    return elapsed, asr.sent, asr.sent_bytes
+
+
+def run_ingest(messages, batch_ms, vad):
+    stage = AudioIngest(batch_ms=batch_ms, vad=vad)
+    asr = AsrSocket()
+    started = time.perf_counter()
+    for message in messages:
+        for chunk in stage.push(message):
+            asr.send(chunk)
+    for chunk in stage.flush():
+        asr.send(chunk)
+    elapsed = time.perf_counter() - started
+    asr.close()
+    return elapsed, asr.sent, asr.sent_bytes
+
+
+def main_bench():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=int, default=60)
+    parser.add_argument("--talk-share", type=float, default=0.35, help="fraction of the call the caller speaks")
+    parser.add_argument("--batch-ms", type=int, default=ingest.INGEST_BATCH_MS)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    messages = twilio_messages(caller_audio(args.seconds, args.talk_share))
+    per_min = 60 / args.seconds
+    print(f"{len(messages)} media events ({args.seconds} s, caller talking {args.talk_share:.0%})")
+    print()
+    print(f"{'path':28s} {'time ms/min':>11s} {'ASR msgs/min':>13s} {'ASR KB/min':>11s}")
+    rows = [
+        ("per-frame (original)", lambda: run_legacy(messages)),
+        (f"batched {args.batch_ms} ms", lambda: run_ingest(messages, args.batch_ms, False)),
+        (f"batched {args.batch_ms} ms + VAD", lambda: run_ingest(messages, args.batch_ms, True)),
+    ]
+    for name, fn in rows:
+        results = [fn() for _ in range(args.repeat)]
+        cpu = min(r[0] for r in results)
+        _, sent, sent_bytes = results[0]
+        print(f"{name:28s} {cpu * 1000 * per_min:11.2f} {sent * per_min:13.0f} {sent_bytes * per_min / 1024:11.1f}")
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,183 @@
+"""
+Micro-benchmark: per-turn Redis round trips and latency of the pipelined
+CallSession versus the original load_conversation/save_conversation path.
+
+    python benchmarks/bench_session_store.py --turns 12 --rtt-ms 1.5
+
+Uses fakeredis unless --redis-url (or REDIS_URL) points at a real server.
+--rtt-ms adds a simulated network round trip to every call, which is what
+a hosted Redis costs from the web service.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")
+
+import redis
+import redis.asyncio as aioredis
+import main
+from session_store import CallSession
+
+
+class RoundTrips:
+    def __init__(self, rtt):
+        self.rtt = rtt
+        self.count = 0
+
+
+class CountingRedis:
+    def __init__(self, client, trips):
+        self.client = client
+        self.trips = trips
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+
+        def call(*args, **kwargs):
+            self.trips.count += 1
+            if self.trips.rtt:
+                time.sleep(self.trips.rtt)
+            return attr(*args, **kwargs)
+        return call
+
+
+class CountingPipeline:
+    def __init__(self, pipe, trips):
+        self.pipe = pipe
+        self.trips = trips
+
+    def __getattr__(self, name):
+        return getattr(self.pipe, name)
+
+    async def execute(self):
+        self.trips.count += 1
+        if self.trips.rtt:
+            await asyncio.sleep(self.trips.rtt)
+        return await self.pipe.execute()
+
+
+class CountingAsyncRedis:
+    def __init__(self, client, trips):
+        self.client = client
+        self.trips = trips
+
+    def pipeline(self, transaction=False):
+        return CountingPipeline(self.client.pipeline(transaction=transaction), self.trips)
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+
+        async def call(*args, **kwargs):
+            self.trips.count += 1
+            if self.trips.rtt:
+                await asyncio.sleep(self.trips.rtt)
+            return await attr(*args, **kwargs)
+        return call
+
+
+def make_clients(redis_url):
+    if redis_url:
+        return redis.from_url(redis_url), aioredis.from_url(redis_url)
+    import fakeredis
+    server = fakeredis.FakeServer()
+    return fakeredis.FakeRedis(server=server), fakeredis.FakeAsyncRedis(server=server)
+
+
+def script(turns):
+    for i in range(turns):
+        user = "My zip is 77494" if i == 1 else f"Caller line {i}"
+        yield user, f"Assistant reply {i}", i == turns - 1
+
+
+def load_conversation(r, sid):
+    # The original main.load_conversation / save_conversation
+    data = r.get(f"history:{sid}")
+    return json.loads(data.decode()) if data else []
+
+
+def save_conversation(r, sid, history):
+    if len(history) > 15:
+        history = history[:1] + history[-15:]
+    r.set(f"history:{sid}", json.dumps(history), ex=3600)
+
+
+def legacy_call(sid, turns, phone):
+    # Mirrors the per-turn Redis traffic of the original receive_from_assemblyai
+    r = main.get_redis_client()
+    for user, reply, booking in script(turns):
+        history = load_conversation(r, sid)
+        history.append({"role": "user", "content": user})
+        save_conversation(r, sid, history)
+        if "77" in user:
+            r.set(f"zip:{sid}", "77494", ex=900)
+        r.set(f"phone:{sid}", phone, ex=900)
+        r.get(f"zip:{sid}")
+        if booking:
+            r.set(f"zip:{sid}", "77494", ex=900)
+            r.set(f"address:{sid}", "1 Main St, Katy TX 77494", ex=900)
+            r.set(f"time:{sid}", "Tuesday at 10:00 AM", ex=900)
+            r.set(f"notified:{sid}", "1", ex=1800)
+        history = load_conversation(r, sid)
+        history.append({"role": "assistant", "content": reply})
+        save_conversation(r, sid, history)
+
+
+async def session_call(sid, turns, phone, client):
+    session = await CallSession(sid, client).load()
+    for user, reply, booking in script(turns):
+        session.append("user", user)
+        if "77" in user:
+            session.set_slot("zip", "77494")
+        session.set_slot("phone", phone)
+        if booking:
+            session.set_slot("address", "1 Main St, Katy TX 77494")
+            session.set_slot("time", "Tuesday at 10:00 AM")
+            session.set_slot("notified", "1")
+        session.append("assistant", reply)
+        await session.commit()
+
+
+def main_bench():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=12)
+    parser.add_argument("--calls", type=int, default=20)
+    parser.add_argument("--rtt-ms", type=float, default=1.0)
+    parser.add_argument("--redis-url", default=None)
+    args = parser.parse_args()
+
+    sync_client, async_client = make_clients(args.redis_url)
+    rtt = args.rtt_ms / 1000
+
+    legacy_trips = RoundTrips(rtt)
+    main._redis_client = CountingRedis(sync_client, legacy_trips)
+    start = time.perf_counter()
+    for i in range(args.calls):
+        legacy_call(f"bench-legacy-{i}", args.turns, "+15550000000")
+    legacy_elapsed = time.perf_counter() - start
+
+    session_trips = RoundTrips(rtt)
+    client = CountingAsyncRedis(async_client, session_trips)
+
+    async def run_sessions():
+        for i in range(args.calls):
+            await session_call(f"bench-session-{i}", args.turns, "+15550000000", client)
+    start = time.perf_counter()
+    asyncio.run(run_sessions())
+    session_elapsed = time.perf_counter() - start
+
+    total_turns = args.calls * args.turns
+    print(f"{args.calls} calls x {args.turns} turns, simulated RTT {args.rtt_ms} ms")
+    print(f"{'':<22}{'round trips':>12}{'per turn':>10}{'ms/turn':>10}")
+    for name, trips, elapsed in (("load/save_conversation", legacy_trips, legacy_elapsed),
+                                 ("CallSession", session_trips, session_elapsed)):
+        print(f"{name:<22}{trips.count:>12}{trips.count / total_turns:>10.2f}"
+              f"{elapsed / total_turns * 1000:>10.3f}")
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,114 @@
+"""
+Micro-benchmark: per-turn slot lookup over synthetic calendars, the original
+exact-ZIP scan of the event list versus slot_search.Schedule.best_slots.
+
+    python benchmarks/bench_slot_search.py --events 1000,5000,20000 --queries 2000
+
+Each synthetic crew works a cluster of nearby ZIPs from the bundled table
+for up to five appointments a day. All events fall inside the search
+horizon, so every lookup is vectorized over the whole calendar. Also reports how many
+callers get at least one slot: exact ZIP only versus within --radius miles.
+"""
+import os
+import sys
+import time
+import random
+import re
+import argparse
+import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import slot_search
+from slot_search import Schedule, get_zip_index
+
+
+def exact_zip_scan(user_zip, events):
+    # The original exact-ZIP lookup (formerly main.get_calendar_zip_matches)
+    matches = []
+    for event in events:
+        location = event.get('location', '')
+        match = re.search(r'\b77\d{3}\b', location)
+        if match and match.group(0) == user_zip:
+            matches.append(event['start'].get('dateTime', event['start'].get('date')))
+    return matches
+
+
+def synthetic_events(count, days, zips, per_day=5, seed=11):
+    # Enough crews to hold `count` appointments, each working a day of
+    # per_day jobs in one part of town with gaps between them
+    rnd = random.Random(seed)
+    base = datetime.datetime.now(slot_search.CALENDAR_TIMEZONE).replace(
+        hour=0, minute=0, second=0, microsecond=0) + datetime.timedelta(days=1)
+    index = get_zip_index()
+    events = []
+    crew = 0
+    while len(events) < count:
+        for day in range(days):
+            home = rnd.choice(zips)
+            area = [z for z, _ in index.neighbors(home, 12)] or [home]
+            at = base + datetime.timedelta(days=day, hours=8, minutes=rnd.choice((0, 30)))
+            for _ in range(per_day):
+                at += datetime.timedelta(minutes=rnd.choice((15, 30, 45, 60, 90)))
+                end = at + datetime.timedelta(minutes=rnd.choice((60, 90, 120)))
+                if end.hour >= 18 or len(events) == count:
+                    break
+                z = rnd.choice(area)
+                events.append({"id": str(len(events)), "location": f"{rnd.randint(100, 19999)} Main St, Houston, TX {z}",
+                               "start": {"dateTime": at.isoformat()}, "end": {"dateTime": end.isoformat()},
+                               "_entry": (at, end, z, f"crew-{crew}")})
+                at = end
+        crew += 1
+    return events
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    return ordered[len(ordered) // 2], ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+
+
+def main_bench():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", default="1000,5000,20000")
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--scan-queries", type=int, default=200, help="the original scan is slow; fewer samples")
+    parser.add_argument("--radius", type=float, default=slot_search.SLOT_RADIUS_MILES)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    index = get_zip_index()
+    print(f"ZIP table: {len(index.zips)} ZIPs, distance matrix built in {(time.perf_counter() - started) * 1000:.1f} ms")
+    print()
+    print(f"{'events':>7s} {'build ms':>9s} | {'scan p50 us':>11s} {'p99':>7s} {'hit':>5s} | "
+          f"{'slots p50 us':>12s} {'p99':>7s} {'hit':>5s}")
+    rnd = random.Random(3)
+    for count in (int(n) for n in args.events.split(",")):
+        events = synthetic_events(count, args.days, index.zips)
+        started = time.perf_counter()
+        schedule = Schedule.build([e["_entry"] for e in events], index)
+        build_ms = (time.perf_counter() - started) * 1000
+        callers = [rnd.choice(index.zips) for _ in range(args.queries)]
+
+        scan, scan_hits = [], 0
+        for z in callers[:args.scan_queries]:
+            started = time.perf_counter()
+            found = exact_zip_scan(z, events)[:2]
+            scan.append((time.perf_counter() - started) * 1e6)
+            scan_hits += bool(found)
+
+        search, search_hits = [], 0
+        for z in callers:
+            started = time.perf_counter()
+            found = schedule.best_slots(z, limit=2, radius_miles=args.radius)
+            search.append((time.perf_counter() - started) * 1e6)
+            search_hits += bool(found)
+
+        s50, s99 = percentiles(scan)
+        n50, n99 = percentiles(search)
+        print(f"{count:7d} {build_ms:9.1f} | {s50:11.0f} {s99:7.0f} {scan_hits / len(scan):5.0%} | "
+              f"{n50:12.0f} {n99:7.0f} {search_hits / len(callers):5.0%}")
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,146 @@
+"""
+Cold-start benchmark: time from launching a fresh worker process to it
+accepting traffic, and the latency of the first webhook it serves.
+
+    python benchmarks/bench_startup.py --runs 5
+    python benchmarks/bench_startup.py --runs 1 --importtime
+
+Each run starts a new interpreter that imports server.py, runs the app's
+startup (main.warmup, then the background services) and opens its port,
+against the local fakes (benchmarks/fakes.py) and fakeredis. Reported per
+run: interpreter start + imports, each warmup step, time-to-ready, and the
+first /voice-greeting request. --importtime lists the slowest imports.
+Copy the script into an older checkout to compare against it.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import statistics
+import multiprocessing
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from fakes import Latencies
+from loadtest import run_fakes_process
+
+CHILD = r"""
+import sys, time, json, asyncio
+import fakeredis
+started = time.perf_counter()
+sys.path.insert(0, %(root)r)
+import server
+import main
+import session_store
+session_store._async_redis = fakeredis.FakeAsyncRedis()
+imported = time.perf_counter()
+from aiohttp import web
+
+timings = {}
+warmup = getattr(main, "warmup", None)
+
+async def timed_warmup():
+    timings.update(await warmup())
+    return timings
+
+# Older trees without main.warmup are measured as a whole
+if warmup:
+    main.warmup = timed_warmup
+
+async def run():
+    runner = web.AppRunner(await server.create_app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", %(port)d).start()
+    print("READY " + json.dumps({"import_ms": (imported - started) * 1000,
+                                 "startup_ms": (time.perf_counter() - imported) * 1000,
+                                 "warmup": timings}), flush=True)
+    await asyncio.Event().wait()
+
+asyncio.run(run())
+"""
+
+
+def one_run(port, env):
+    launched = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-c", CHILD % {"root": ROOT_DIR, "port": port}],
+                            cwd=ROOT_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        for line in proc.stdout:
+            if line.startswith("READY "):
+                ready_ms = (time.perf_counter() - launched) * 1000
+                result, _ = json.JSONDecoder().raw_decode(line[6:])
+                break
+        else:
+            raise RuntimeError("server exited before becoming ready")
+        started = time.perf_counter()
+        request = urllib.request.Request(f"http://127.0.0.1:{port}/voice-greeting",
+                                         data=b"CallSid=CA-startup-bench", method="POST")
+        urllib.request.urlopen(request, timeout=30).read()
+        result["first_webhook_ms"] = (time.perf_counter() - started) * 1000
+        result["ready_ms"] = ready_ms
+        return result
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def import_profile(env, top=12):
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import server"],
+                         cwd=ROOT_DIR, env=env, capture_output=True, text=True).stderr
+    rows = []
+    for line in out.splitlines():
+        if line.startswith("import time:") and "|" in line and "cumulative" not in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            rows.append((int(cumulative), name.rstrip()))
+    print("slowest imports (cumulative ms) of `import server`:")
+    for us, name in sorted(rows, reverse=True)[:top]:
+        print(f"  {us / 1000:8.1f}  {name}")
+    print()
+
+
+def main_bench():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=18865)
+    parser.add_argument("--aai-port", type=int, default=18866)
+    parser.add_argument("--http-port", type=int, default=18867)
+    parser.add_argument("--importtime", action="store_true")
+    args = parser.parse_args()
+
+    host = "127.0.0.1"
+    ready = multiprocessing.Event()
+    fakes = multiprocessing.Process(target=run_fakes_process, daemon=True,
+                                    args=(host, args.aai_port, args.http_port, Latencies(), ready))
+    fakes.start()
+    ready.wait(10)
+    env = dict(os.environ,
+               ASSEMBLYAI_API_KEY="fake", ASSEMBLYAI_REALTIME_URL=f"ws://{host}:{args.aai_port}/v2/realtime/ws",
+               OPENAI_API_KEY="fake", OPENAI_BASE_URL=f"http://{host}:{args.http_port}/v1",
+               ELEVENLABS_API_KEY="fake", ELEVENLABS_VOICE_ID="fake-voice",
+               ELEVENLABS_API_URL=f"http://{host}:{args.http_port}",
+               REDIS_URL="redis://localhost:6379/0", METRICS_REDIS_URL="",
+               CALENDAR_REDIS_URL="")
+
+    if args.importtime:
+        import_profile(env)
+
+    results = [one_run(args.port, env) for _ in range(args.runs)]
+    steps = [name for name in results[0]["warmup"] if name != "total"]
+    print(f"{args.runs} cold starts, median ms (min-max)")
+    rows = [("imports (in process)", [r["import_ms"] for r in results])]
+    rows += [(f"  warmup: {name}", [r["warmup"].get(name, 0) for r in results]) for name in steps]
+    rows += [("startup incl. warmup", [r["startup_ms"] for r in results]),
+             ("time to ready (launch)", [r["ready_ms"] for r in results]),
+             ("first /voice-greeting", [r["first_webhook_ms"] for r in results])]
+    for name, values in rows:
+        print(f"  {name:24s} {statistics.median(values):8.1f}   ({min(values):.1f}-{max(values):.1f})")
+    fakes.terminate()
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,174 @@
+"""
+Local stand-ins for the live services a call depends on, for load testing.
+
+- FakeAssemblyAI: realtime WebSocket that turns caller speech into
+  PartialTranscript/FinalTranscript messages using a simple energy detector.
+- FakeOpenAI / FakeElevenLabs: a small keep-alive HTTP/1.1 server serving
+  streamed chat completions (SSE) and streamed µ-law TTS audio.
+
+Every stage has a configurable latency so the harness can model slow or
+fast upstreams.
+"""
+import json
+import time
+import audioop
+import asyncio
+import websockets
+
+SCRIPT = [
+    "Hi how much does it cost to get my air ducts cleaned",
+    "My zip code is 77494",
+    "Tuesday morning would work for me",
+    "The address is 12 Main Street in Katy",
+]
+REPLY = ("Great question. We actually never give prices over the phone because every home is different, "
+         "so we do a free in-person estimate. What day works best for you?")
+
+
+class Latencies:
+    def __init__(self, asr_endpoint_ms=500, asr_partial_ms=150, llm_first_token_ms=350,
+                 llm_token_ms=15, tts_first_byte_ms=250, tts_realtime_factor=4.0):
+        self.asr_endpoint_ms = asr_endpoint_ms
+        self.asr_partial_ms = asr_partial_ms
+        self.llm_first_token_ms = llm_first_token_ms
+        self.llm_token_ms = llm_token_ms
+        self.tts_first_byte_ms = tts_first_byte_ms
+        self.tts_realtime_factor = tts_realtime_factor
+
+
+# --- FAKE ASSEMBLYAI REALTIME
+class FakeAssemblyAI:
+    SPEECH_RMS = 500
+
+    def __init__(self, latencies):
+        self.lat = latencies
+        self.sessions = 0
+
+    async def handler(self, websocket, path=None):
+        self.sessions += 1
+        await websocket.send(json.dumps({"message_type": "SessionBegins", "session_id": str(self.sessions)}))
+        state = {"utterance": 0, "speech_ms": 0, "silence_ms": 0, "last_partial_ms": 0}
+        try:
+            async for message in websocket:
+                if not isinstance(message, str):
+                    await self.on_audio(websocket, message, state)
+                elif json.loads(message).get("terminate_session"):
+                    await websocket.send(json.dumps({"message_type": "SessionTerminated"}))
+                    break
+        except websockets.ConnectionClosed:
+            pass
+
+    async def on_audio(self, websocket, message, state):
+        chunk_ms = len(message) / 8
+        script = SCRIPT[state["utterance"] % len(SCRIPT)]
+        if audioop.rms(audioop.ulaw2lin(message, 2), 2) >= self.SPEECH_RMS:
+            state["speech_ms"] += chunk_ms
+            state["silence_ms"] = 0
+            if state["speech_ms"] - state["last_partial_ms"] >= self.lat.asr_partial_ms:
+                state["last_partial_ms"] = state["speech_ms"]
+                heard = script.split()[:max(1, int(state["speech_ms"] / self.lat.asr_partial_ms))]
+                await websocket.send(json.dumps({"message_type": "PartialTranscript",
+                                                 "text": " ".join(heard).lower()}))
+        elif state["speech_ms"]:
+            state["silence_ms"] += chunk_ms
+            if state["silence_ms"] >= self.lat.asr_endpoint_ms:
+                await websocket.send(json.dumps({"message_type": "FinalTranscript", "text": script + "."}))
+                state.update(utterance=state["utterance"] + 1, speech_ms=0, silence_ms=0, last_partial_ms=0)
+
+    async def serve(self, host, port):
+        return await websockets.serve(self.handler, host, port)
+
+
+# --- FAKE OPENAI + ELEVENLABS (one HTTP server, routed by path)
+class FakeHTTPUpstreams:
+    def __init__(self, latencies):
+        self.lat = latencies
+        self.requests = {"chat": 0, "tts": 0}
+
+    async def serve(self, host, port):
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, value = line.decode().split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                if path.endswith("/chat/completions"):
+                    await self.chat(writer, json.loads(body or b"{}"))
+                elif "/text-to-speech/" in path:
+                    await self.tts(writer, json.loads(body or b"{}"))
+                else:
+                    writer.write(b"HTTP/1.1 404 Not Found\r\ncontent-length: 0\r\n\r\n")
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start_chunked(self, writer, content_type):
+        writer.write(f"HTTP/1.1 200 OK\r\ncontent-type: {content_type}\r\n"
+                     "transfer-encoding: chunked\r\n\r\n".encode())
+        await writer.drain()
+
+    async def write_chunk(self, writer, data):
+        writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+        await writer.drain()
+
+    async def chat(self, writer, request):
+        self.requests["chat"] += 1
+        if not request.get("stream"):
+            # Background calls (running summary) use a plain completion
+            await asyncio.sleep(self.lat.llm_first_token_ms / 1000)
+            body = json.dumps({
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()),
+                "model": request.get("model", "gpt-4o-mini"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "The caller asked about pricing."},
+                             "finish_reason": "stop"}],
+            }).encode()
+            writer.write(b"HTTP/1.1 200 OK\r\ncontent-type: application/json\r\ncontent-length: %d\r\n\r\n%s"
+                         % (len(body), body))
+            await writer.drain()
+            return
+        await self.start_chunked(writer, "text/event-stream")
+        await asyncio.sleep(self.lat.llm_first_token_ms / 1000)
+        for i, word in enumerate(REPLY.split(" ")):
+            if i:
+                await asyncio.sleep(self.lat.llm_token_ms / 1000)
+            chunk = {
+                "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": request.get("model", "gpt-4o"),
+                "choices": [{"index": 0, "delta": {"content": (" " if i else "") + word}, "finish_reason": None}],
+            }
+            await self.write_chunk(writer, f"data: {json.dumps(chunk)}\n\n".encode())
+        await self.write_chunk(writer, b"data: [DONE]\n\n")
+        await self.write_chunk(writer, b"")
+
+    async def tts(self, writer, request):
+        self.requests["tts"] += 1
+        await self.start_chunked(writer, "audio/basic")
+        await asyncio.sleep(self.lat.tts_first_byte_ms / 1000)
+        # Roughly 65 ms of speech per character, delivered faster than real time
+        audio_ms = len(request.get("text", "")) * 65
+        chunk_ms = 100
+        for _ in range(0, int(audio_ms), chunk_ms):
+            await self.write_chunk(writer, b"\x55" * (chunk_ms * 8))
+            await asyncio.sleep(chunk_ms / 1000 / self.lat.tts_realtime_factor)
+        await self.write_chunk(writer, b"")
+
+
+async def run_fakes(host, aai_port, http_port, latencies, ready=None):
+    await FakeAssemblyAI(latencies).serve(host, aai_port)
+    await FakeHTTPUpstreams(latencies).serve(host, http_port)
+    if ready is not None:
+        ready.set()
+    await asyncio.Future()
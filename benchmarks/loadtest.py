@@ -0,0 +1,325 @@
+"""
+Offline multi-call load test for the media-stream server.
+
+Runs process_media_stream against local fakes (benchmarks/fakes.py) in a
+separate process, ramps concurrent simulated Twilio calls, and reports
+p50/p95/p99 time-to-first-audio, end-to-end turn latency and server
+event-loop lag for each concurrency level.
+
+    python benchmarks/loadtest.py --ramp 1,10,25,50 --turns 3
+    python benchmarks/loadtest.py --audio caller.ulaw --llm-first-token-ms 600
+
+Latencies are measured from the moment the fake ASR finalizes the
+utterance (end of caller speech + --asr-endpoint-ms). With --target the
+harness drives an already running server instead of starting one; that
+server must point ASSEMBLYAI_REALTIME_URL, OPENAI_BASE_URL and
+ELEVENLABS_API_URL at the fakes this script starts. Without --redis-url
+the server under test uses fakeredis (pip install fakeredis).
+
+--workers N runs the production stack instead (gunicorn + server.py, N
+worker processes on one port), to check that throughput scales with cores:
+
+    python benchmarks/loadtest.py --workers 1 --ramp 25,50,100
+    python benchmarks/loadtest.py --workers 4 --ramp 25,50,100
+
+Event-loop lag is only sampled for the single-process server.
+"""
+import os
+import sys
+import json
+import math
+import time
+import base64
+import audioop
+import asyncio
+import socket
+import argparse
+import subprocess
+import multiprocessing
+from collections import deque
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+import websockets
+from fakes import Latencies, run_fakes
+
+FRAME_BYTES = 160
+REPLY_GAP_S = 0.4
+TURN_TIMEOUT_S = 15
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(p / 100 * len(ordered))) - 1)]
+
+
+def synthetic_speech(seconds):
+    # A warbling tone is enough for the fake ASR's energy detector
+    samples = bytearray()
+    for n in range(int(seconds * 8000)):
+        amp = 6000 + 3000 * math.sin(2 * math.pi * 3 * n / 8000)
+        value = int(amp * math.sin(2 * math.pi * 220 * n / 8000))
+        samples += value.to_bytes(2, "little", signed=True)
+    return audioop.lin2ulaw(bytes(samples), 2)
+
+
+def to_frames(ulaw):
+    usable = len(ulaw) - len(ulaw) % FRAME_BYTES
+    return [base64.b64encode(ulaw[i:i + FRAME_BYTES]).decode() for i in range(0, usable, FRAME_BYTES)]
+
+
+# --- SERVER UNDER TEST
+def serve_under_test(port, env, redis_url, conn):
+    os.environ.update(env)
+    import main
+    import intents
+    import session_store
+    # Canned replies are rendered through the fake TTS, as production renders them at startup
+    intents.warm()
+    if not redis_url:
+        import fakeredis
+        session_store._async_redis = fakeredis.FakeAsyncRedis()
+
+    lag_ms = []
+
+    async def monitor(interval=0.05):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            lag_ms.append((loop.time() - start - interval) * 1000)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        await websockets.serve(main.process_media_stream, "127.0.0.1", port, max_size=None)
+        main.start_upstreams()
+        asyncio.create_task(monitor())
+        conn.send("ready")
+        while True:
+            command = await loop.run_in_executor(None, conn.recv)
+            if command == "lag":
+                conn.send(list(lag_ms))
+                lag_ms.clear()
+            elif command == "stop":
+                return
+
+    asyncio.run(run())
+
+
+def start_gunicorn(port, workers, env, redis_url):
+    env = dict(os.environ, **env, LOADTEST_FAKEREDIS="0" if redis_url else "1")
+    if not redis_url:
+        # Workers on separate fakeredis instances have nothing to share metrics
+        # or the calendar sync through
+        env.update(METRICS_REDIS_URL="", CALENDAR_REDIS_URL="")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", os.path.join(ROOT_DIR, "gunicorn.conf.py"),
+         "--workers", str(workers), "--bind", f"127.0.0.1:{port}", "--pythonpath", BENCH_DIR,
+         "loadtest_app:create_app"],
+        cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            # Give the remaining workers a moment to finish warming up
+            time.sleep(2)
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("gunicorn did not start")
+
+
+def run_fakes_process(host, aai_port, http_port, latencies, ready):
+    class Ready:
+        def set(self):
+            ready.set()
+    asyncio.run(run_fakes(host, aai_port, http_port, latencies, Ready()))
+
+
+# --- SIMULATED TWILIO CALLER
+class LevelStats:
+    def __init__(self):
+        self.ttfa = []
+        self.turn = []
+        self.timeouts = 0
+        self.errors = 0
+
+
+async def run_call(target, idx, turns, speech_frames, silence_frame, endpoint_s, stats):
+    sid = f"CA-load-{idx}-{int(time.time() * 1000)}"
+    stream_sid = f"MZ-load-{idx}"
+    media_times = []
+    got_media = asyncio.Event()
+    to_speak = deque()
+
+    async with websockets.connect(target, max_size=None) as ws:
+        # Twilio's shape: the <Parameter>s from the TwiML come back as customParameters
+        await ws.send(json.dumps({"event": "connected", "protocol": "Call", "version": "1.0.0"}))
+        await ws.send(json.dumps({"event": "start", "sequenceNumber": "1", "streamSid": stream_sid,
+                                  "start": {"accountSid": "AC-load", "callSid": sid, "streamSid": stream_sid,
+                                            "tracks": ["inbound"],
+                                            "mediaFormat": {"encoding": "audio/x-mulaw", "sampleRate": 8000,
+                                                            "channels": 1},
+                                            "customParameters": {"sid": sid, "caller": f"+1555010{idx:04d}"}}}))
+
+        async def receiver():
+            async for message in ws:
+                if message.startswith('{"event":"media"') or '"event": "media"' in message[:40]:
+                    media_times.append(time.perf_counter())
+                    got_media.set()
+
+        async def sender():
+            # Twilio sends a frame every 20 ms whether or not the caller is talking
+            next_at = time.perf_counter()
+            while True:
+                payload = to_speak.popleft() if to_speak else silence_frame
+                await ws.send('{"event":"media","streamSid":"%s","media":{"payload":"%s"}}' % (stream_sid, payload))
+                next_at += 0.02
+                await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+
+        tasks = [asyncio.create_task(receiver()), asyncio.create_task(sender())]
+        try:
+            for turn in range(turns):
+                to_speak.extend(speech_frames[turn % len(speech_frames)])
+                while to_speak:
+                    await asyncio.sleep(0.02)
+                final_at = time.perf_counter() + endpoint_s
+                deadline = final_at + TURN_TIMEOUT_S
+                first = None
+                while first is None and time.perf_counter() < deadline:
+                    got_media.clear()
+                    first = next((t for t in reversed(media_times) if t > final_at), None)
+                    if first is None:
+                        try:
+                            await asyncio.wait_for(got_media.wait(), deadline - time.perf_counter())
+                        except asyncio.TimeoutError:
+                            break
+                if first is None:
+                    stats.timeouts += 1
+                    continue
+                first = min(t for t in media_times if t > final_at)
+                while time.perf_counter() - media_times[-1] < REPLY_GAP_S:
+                    await asyncio.sleep(REPLY_GAP_S / 4)
+                stats.ttfa.append((first - final_at) * 1000)
+                stats.turn.append((media_times[-1] - final_at) * 1000)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Hang up the way Twilio does: a stop event, then the socket closes
+            await ws.send(json.dumps({"event": "stop", "streamSid": stream_sid}))
+
+
+async def run_level(target, concurrency, args, speech_frames, silence_frame):
+    stats = LevelStats()
+
+    async def one(idx):
+        # Stagger call starts over a second, as real traffic would
+        await asyncio.sleep(idx / max(concurrency, 1))
+        try:
+            await run_call(target, idx, args.turns, speech_frames, silence_frame,
+                           args.asr_endpoint_ms / 1000, stats)
+        except Exception as e:
+            stats.errors += 1
+            print(f"[LOAD] call {idx} failed: {e}")
+
+    await asyncio.gather(*[one(i) for i in range(concurrency)])
+    return stats
+
+
+def main_loadtest():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ramp", default="1,5,10,25")
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--audio", help="raw 8 kHz µ-law caller recording to replay")
+    parser.add_argument("--speech-ms", type=int, default=1500)
+    parser.add_argument("--target", help="ws:// URL of an already running server's /ws endpoint")
+    parser.add_argument("--redis-url", help="use a real Redis instead of fakeredis")
+    parser.add_argument("--workers", type=int, help="serve with gunicorn and this many worker processes")
+    parser.add_argument("--port", type=int, default=18765)
+    parser.add_argument("--aai-port", type=int, default=18766)
+    parser.add_argument("--http-port", type=int, default=18767)
+    parser.add_argument("--asr-endpoint-ms", type=int, default=500)
+    parser.add_argument("--llm-first-token-ms", type=int, default=350)
+    parser.add_argument("--llm-token-ms", type=int, default=15)
+    parser.add_argument("--tts-first-byte-ms", type=int, default=250)
+    args = parser.parse_args()
+
+    latencies = Latencies(asr_endpoint_ms=args.asr_endpoint_ms, llm_first_token_ms=args.llm_first_token_ms,
+                          llm_token_ms=args.llm_token_ms, tts_first_byte_ms=args.tts_first_byte_ms)
+    host = "127.0.0.1"
+    fakes_ready = multiprocessing.Event()
+    fakes = multiprocessing.Process(target=run_fakes_process, daemon=True,
+                                    args=(host, args.aai_port, args.http_port, latencies, fakes_ready))
+    fakes.start()
+    fakes_ready.wait(10)
+
+    server = conn = gunicorn = None
+    target = args.target
+    if not target:
+        env = {
+            "ASSEMBLYAI_API_KEY": "fake",
+            "ASSEMBLYAI_REALTIME_URL": f"ws://{host}:{args.aai_port}/v2/realtime/ws",
+            "OPENAI_API_KEY": "fake",
+            "OPENAI_BASE_URL": f"http://{host}:{args.http_port}/v1",
+            "ELEVENLABS_API_KEY": "fake",
+            "ELEVENLABS_VOICE_ID": "fake-voice",
+            "ELEVENLABS_API_URL": f"http://{host}:{args.http_port}",
+            "REDIS_URL": args.redis_url or "redis://localhost:6379/0",
+        }
+        if args.workers:
+            gunicorn = start_gunicorn(args.port, args.workers, env, args.redis_url)
+        else:
+            conn, child_conn = multiprocessing.Pipe()
+            server = multiprocessing.Process(target=serve_under_test, daemon=True,
+                                             args=(args.port, env, args.redis_url, child_conn))
+            server.start()
+            conn.recv()
+        target = f"ws://{host}:{args.port}/ws"
+
+    if args.audio:
+        with open(args.audio, "rb") as f:
+            recording = f.read()
+    else:
+        recording = synthetic_speech(args.speech_ms / 1000 * 4)
+    utterance_bytes = args.speech_ms * 8
+    speech_frames = [to_frames(recording[i:i + utterance_bytes])
+                     for i in range(0, max(len(recording) - utterance_bytes, 0) + 1, utterance_bytes)]
+    silence_frame = base64.b64encode(b"\xff" * FRAME_BYTES).decode()
+
+    print(f"Target {target}, {args.turns} turns/call, latencies from ASR final")
+    header = (f"{'calls':>6}{'turns':>7}{'t/o':>5}{'err':>5} | {'TTFA p50':>9}{'p95':>8}{'p99':>8} | "
+              f"{'turn p50':>9}{'p95':>8}{'p99':>8} | {'lag p50':>8}{'p99':>8}{'max':>8}   (ms)")
+    print(header)
+    print("-" * len(header))
+    try:
+        for concurrency in [int(c) for c in args.ramp.split(",")]:
+            if conn:
+                conn.send("lag")
+                conn.recv()
+            stats = asyncio.run(run_level(target, concurrency, args, speech_frames, silence_frame))
+            lag = []
+            if conn:
+                conn.send("lag")
+                lag = conn.recv()
+            print(f"{concurrency:>6}{len(stats.turn):>7}{stats.timeouts:>5}{stats.errors:>5} | "
+                  f"{percentile(stats.ttfa, 50):>9.0f}{percentile(stats.ttfa, 95):>8.0f}{percentile(stats.ttfa, 99):>8.0f} | "
+                  f"{percentile(stats.turn, 50):>9.0f}{percentile(stats.turn, 95):>8.0f}{percentile(stats.turn, 99):>8.0f} | "
+                  f"{percentile(lag, 50):>8.1f}{percentile(lag, 99):>8.1f}{max(lag) if lag else float('nan'):>8.1f}")
+    finally:
+        if conn:
+            conn.send("stop")
+            server.join(5)
+        if gunicorn:
+            gunicorn.terminate()
+            gunicorn.wait(30)
+        fakes.terminate()
+
+
+if __name__ == "__main__":
+    main_loadtest()
@@ -0,0 +1,18 @@
+"""
+gunicorn target for `loadtest.py --workers N`: the production app, with each
+worker on its own fakeredis unless the harness passed a real REDIS_URL.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server
+import session_store
+
+
+async def create_app():
+    if os.environ.get("LOADTEST_FAKEREDIS") == "1":
+        import fakeredis
+        session_store._async_redis = fakeredis.FakeAsyncRedis()
+    return await server.create_app()
@@ -0,0 +1,253 @@
+import os
+import json
+import time
+import socket
+import datetime
+import threading
+from slot_search import Schedule, event_zip
+
+SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
+CALENDAR_REFRESH_SECONDS = int(os.environ.get("CALENDAR_REFRESH_SECONDS", 60))
+# Workers share one Calendar sync through Redis; without it each worker syncs on its own
+CALENDAR_REDIS_URL = os.environ.get("CALENDAR_REDIS_URL", os.environ.get("REDIS_URL"))
+# How often the other workers check for a newer schedule (one small GET)
+CALENDAR_FOLLOW_SECONDS = int(os.environ.get("CALENDAR_FOLLOW_SECONDS", 5))
+
+LEADER_KEY = "calendar:sync:leader"
+SCHEDULE_KEY = "calendar:schedule"
+SCHEDULE_VERSION_KEY = "calendar:schedule:version"
+
+
+def load_credentials():
+    print("ENTER load_credentials()")
+    token_json = os.environ.get("GOOGLE_TOKEN")
+    if not token_json:
+        print("❌ No GOOGLE_TOKEN environment variable found.")
+        return None
+    from google.oauth2.credentials import Credentials
+    try:
+        data = json.loads(token_json)
+        creds = Credentials.from_authorized_user_info(data, SCOPES)
+        return creds
+    except Exception as e:
+        print("❌ Failed to load credentials from GOOGLE_TOKEN:", e)
+        return None
+
+
+def isoparse(value):
+    # Google client and dateutil are imported on first use, not when the web worker boots
+    import dateutil.parser
+    return dateutil.parser.isoparse(value)
+
+
+def parse_event_start(event):
+    start = event['start'].get('dateTime', event['start'].get('date'))
+    dt = isoparse(start)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt, start
+
+
+class CalendarAvailability:
+    """
+    In-memory schedule of upcoming calendar events (see slot_search). A
+    background thread does one full sync, then pulls only changes using the
+    Calendar sync token, so per-turn lookups never touch the network.
+
+    With several workers, only the one holding the Redis leader key talks to
+    Google. It publishes the indexed events to Redis and the others rebuild
+    their schedule from there. If the leader goes away its key expires and
+    another worker takes over (starting with a full sync).
+    """
+
+    def __init__(self, calendar_id='primary', refresh_seconds=CALENDAR_REFRESH_SECONDS):
+        self.calendar_id = calendar_id
+        self.refresh_seconds = refresh_seconds
+        self.creds = None
+        self.service = None
+        self.sync_token = None
+        self.events = {}
+        self.schedule = None
+        self.ready = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.redis = None
+        self.worker = None
+        self.leading = False
+        self.version = None
+
+    # --- lookups (called from the audio loop)
+    def open_slots(self, user_zip, limit=2):
+        # None means the schedule has not loaded yet, as opposed to "nothing near this ZIP"
+        if not self.ready.is_set():
+            return None
+        return self.schedule.best_slots(user_zip, limit=limit)
+
+    # --- background refresh
+    def start(self, redis_url=CALENDAR_REDIS_URL):
+        if self.thread and self.thread.is_alive():
+            return
+        if redis_url and self.redis is None:
+            import redis
+            self.redis = redis.from_url(redis_url)
+            self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._run, name="calendar-sync", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.leading:
+            # Let another worker take over now rather than when the key expires
+            try:
+                if self.redis.get(LEADER_KEY) == self.worker.encode():
+                    self.redis.delete(LEADER_KEY)
+            except Exception as e:
+                print(f"[CAL] Failed to release the sync leader key: {e}")
+            self.leading = False
+
+    def _run(self):
+        while not self.stopping.is_set():
+            try:
+                if self._lead():
+                    self.refresh()
+                else:
+                    self.follow()
+            except Exception as e:
+                print(f"[CAL] Calendar refresh failed: {e}")
+            self.stopping.wait(self.refresh_seconds if self.leading else CALENDAR_FOLLOW_SECONDS)
+
+    def _lead(self):
+        # True when this worker should sync with Google itself
+        if self.redis is None:
+            return True
+        import redis
+        ttl = self.refresh_seconds * 3
+        try:
+            if self.redis.set(LEADER_KEY, self.worker, nx=True, ex=ttl):
+                leading = True
+            elif self.redis.get(LEADER_KEY) == self.worker.encode():
+                self.redis.expire(LEADER_KEY, ttl)
+                leading = True
+            else:
+                leading = False
+        except redis.RedisError as e:
+            print(f"[CAL] Redis unavailable, syncing this worker's calendar itself: {e}")
+            return True
+        if leading and not self.leading:
+            print(f"[CAL] Worker {self.worker} is now the calendar sync leader")
+            # Our cached events may be stale: begin with a full sync
+            self.sync_token = None
+            self.events = {}
+            self.version = None
+        self.leading = leading
+        return leading
+
+    def follow(self):
+        # Rebuild from the schedule the leader published, when it has changed
+        version = self.redis.get(SCHEDULE_VERSION_KEY)
+        if version is None or version == self.version:
+            return
+        data = self.redis.get(SCHEDULE_KEY)
+        if data is None:
+            return
+        payload = json.loads(data)
+        entries = [(datetime.datetime.fromtimestamp(start, datetime.timezone.utc),
+                    datetime.datetime.fromtimestamp(end, datetime.timezone.utc), zip_code, crew)
+                   for start, end, zip_code, crew in payload["entries"]]
+        self.schedule = Schedule.build(entries)
+        self.version = version
+        self.ready.set()
+        print(f"[CAL] Loaded {len(self.schedule)} events from the sync leader")
+
+    def get_service(self):
+        if self.creds is None:
+            self.creds = load_credentials()
+            self.service = None
+        if self.creds is None:
+            return None
+        if self.creds.expired and self.creds.refresh_token:
+            from google.auth.transport.requests import Request
+            self.creds.refresh(Request())
+        if self.service is None:
+            from googleapiclient.discovery import build
+            # Discovery document bundled with google-api-python-client: no network fetch
+            self.service = build('calendar', 'v3', credentials=self.creds, static_discovery=True,
+                                 cache_discovery=False)
+        return self.service
+
+    def refresh(self):
+        from googleapiclient.errors import HttpError
+        service = self.get_service()
+        if service is None:
+            return
+        try:
+            changed = self._sync(service)
+        except HttpError as e:
+            if e.resp.status != 410:
+                raise
+            # Sync token expired: start over with a full sync
+            print("[CAL] Sync token invalidated, running full sync")
+            self.sync_token = None
+            self.events = {}
+            changed = self._sync(service)
+        if changed or not self.ready.is_set() or (self.leading and self.version is None):
+            self._reindex()
+            self.ready.set()
+
+    def _sync(self, service):
+        params = {'calendarId': self.calendar_id, 'singleEvents': True, 'maxResults': 250}
+        if self.sync_token:
+            params['syncToken'] = self.sync_token
+        else:
+            params['timeMin'] = datetime.datetime.utcnow().isoformat() + 'Z'
+        changed = 0
+        while True:
+            result = service.events().list(**params).execute()
+            for event in result.get('items', []):
+                changed += 1
+                if event.get('status') == 'cancelled':
+                    self.events.pop(event['id'], None)
+                else:
+                    self.events[event['id']] = event
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                self.sync_token = result.get('nextSyncToken')
+                return changed
+            params['pageToken'] = page_token
+
+    def _reindex(self):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        entries = []
+        for event_id, event in list(self.events.items()):
+            try:
+                start_dt, _ = parse_event_start(event)
+                end_dt = isoparse(event['end']['dateTime'])
+            except (KeyError, ValueError):
+                # All-day events carry no route
+                continue
+            if end_dt < now:
+                # Past events can never be offered again
+                self.events.pop(event_id, None)
+                continue
+            # Optional crew assignment, set as a shared extended property on the event
+            crew = event.get('extendedProperties', {}).get('shared', {}).get('crew')
+            entries.append((start_dt, end_dt, event_zip(event.get('location')), crew))
+        schedule = Schedule.build(entries)
+        self.schedule = schedule
+        located = int((schedule.zip_idx != schedule.zips.unknown).sum())
+        print(f"[CAL] Indexed {len(schedule)} events, {located} with a known ZIP")
+        if self.leading:
+            self._publish(entries)
+
+    def _publish(self, entries):
+        version = str(time.time())
+        payload = json.dumps({"entries": [(start.timestamp(), end.timestamp(), zip_code, crew)
+                                          for start, end, zip_code, crew in entries]})
+        pipe = self.redis.pipeline()
+        pipe.set(SCHEDULE_KEY, payload)
+        pipe.set(SCHEDULE_VERSION_KEY, version)
+        pipe.execute()
+        self.version = version.encode()
+
+calendar_availability = CalendarAvailability()
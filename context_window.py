@@ -0,0 +1,160 @@
+"""
+Builds each turn's GPT-4o messages against a token budget:
+
+    [constant system prompt]            identical every turn, so the provider's prompt cache can serve it
+    [call state]                        running summary of older turns + known slots, compact
+    [recent turns, newest kept first]   as many as fit in CONTEXT_TOKEN_BUDGET
+    [caller's transcript]
+
+Older turns are folded into the running summary by a background task after
+the turn's reply is under way, never on the critical path.
+
+Token counts use tiktoken when it is installed, a characters/4 estimate otherwise.
+"""
+import os
+import asyncio
+from metrics import registry
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _encoding = None
+
+# --- ENV VARS
+# Tokens for call state + recent turns + transcript; the system prompt is not counted
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 1200))
+SUMMARY_MODEL = os.environ.get("SUMMARY_MODEL", "gpt-4o-mini")
+# Unsummarized messages that trigger a fold, and how many stay verbatim after it
+SUMMARIZE_AFTER = int(os.environ.get("SUMMARIZE_AFTER", 10))
+KEEP_RECENT = int(os.environ.get("KEEP_RECENT", 4))
+SUMMARY_MAX_TOKENS = int(os.environ.get("SUMMARY_MAX_TOKENS", 200))
+
+SYSTEM_PROMPT = {
+    "role": "system",
+    "content": (
+        "You are a helpful sales assistant for a premium high end air duct cleaning company that has been in business for 37 years. "
+        "Backed by our 5 star review rating on all platforms, we are the most high end air quality company you can find. "
+        "We are a state licensed mold remediation contractor, & we do dryer vent cleaning for free when we clean the HVAC system as well. Respond conversationally & professionally. "
+        "Great customer service is very important. If it is an outbound call then your goal should be to book them for a free estimate by asking for their ZIP code. "
+        "Then cross reference our google calendar to find a time we will be in their area. If it is an inbound call & they say they are looking to get a quote, price, or estimate, your goal should be to book an estimate. "
+        "UNDER NO CIRCUMSTANCES should you ever give a price, quote, average, ballpark, or estimate over the phone or via text. "
+        "If the customer asks for a price, quote, estimate, or ballpark, politely explain that our company policy is to do a free in-person inspection so we can give the most accurate, customized estimate based on the specific needs of their home. We don't like to play the add-on or upcharge game. Whatever price we give you will stay there! "
+        "Always redirect the conversation toward booking a free in-person estimate, never giving any numbers. "
+        "Sample response: 'We actually never give prices or ballpark estimates over the phone because every home is different. We don't like to play the add-on or upcharge game. So whatever price we give you will stay there. We take pride in doing things the right way. What day works best for you to have one of our experts come out?'"
+    ),
+}
+
+SLOT_LABELS = (
+    ("zip", "ZIP code"),
+    ("address", "address"),
+    ("phone", "caller phone"),
+    ("time", "booked estimate time"),
+)
+
+SUMMARY_PROMPT = (
+    "Update the running summary of a phone call between a caller and an air duct cleaning company's assistant. "
+    "Keep every concrete fact the caller gave (name, address, ZIP, preferred days and times, home details, "
+    "objections, what was already offered or agreed). Plain sentences, no preamble, under 120 words."
+)
+
+registry.describe("voice_context_summaries_total", "Background folds of older turns into the running summary, by result")
+
+
+def count_tokens(text):
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return len(text) // 4 + 1
+
+
+def message_tokens(msg):
+    # Per-message framing overhead in the chat format is about 4 tokens
+    return count_tokens(msg.get("content") or "") + 4
+
+
+def call_state(session):
+    parts = []
+    if session.summary:
+        parts.append(f"Earlier in this call: {session.summary}")
+    known = [f"{label} {session.slots[name]}" for name, label in SLOT_LABELS if session.slots.get(name)]
+    if known:
+        parts.append("Known caller details: " + "; ".join(known) + ".")
+    if session.slots.get("notified"):
+        parts.append("The estimate is already booked and the owner has been notified.")
+    return " ".join(parts)
+
+
+def build_messages(session, transcript):
+    messages = [SYSTEM_PROMPT]
+    user = {"role": "user", "content": transcript}
+    budget = CONTEXT_TOKEN_BUDGET - message_tokens(user)
+    state = call_state(session)
+    if state:
+        messages.append({"role": "system", "content": state})
+        budget -= message_tokens(messages[-1])
+    history = session.history
+    if history and history[-1] == user:
+        # Already recorded when the transcript went final
+        history = history[:-1]
+    recent = []
+    for msg in reversed(history):
+        if msg.get("role") == "system":
+            continue
+        cost = message_tokens(msg)
+        if cost > budget and recent:
+            break
+        recent.append(msg)
+        budget -= cost
+    messages.extend(reversed(recent))
+    messages.append(user)
+    return messages
+
+
+class Summarizer:
+    """Folds a call's older turns into its running summary in the background."""
+
+    def __init__(self, session, get_client):
+        self.session = session
+        self.get_client = get_client
+        self.task = None
+
+    def maybe_start(self):
+        # Call after the turn is committed, so only stored messages are folded
+        if self.task and not self.task.done():
+            return
+        history = self.session.history
+        if len(history) < SUMMARIZE_AFTER + KEEP_RECENT:
+            return
+        self.task = asyncio.create_task(self._fold(history[:len(history) - KEEP_RECENT]))
+
+    async def close(self):
+        if self.task and not self.task.done():
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    async def _fold(self, older):
+        lines = "\n".join(f"{m['role']}: {m['content']}" for m in older if m.get("role") != "system")
+        previous = self.session.summary or "(none yet)"
+        try:
+            response = await self.get_client().chat.completions.create(
+                model=SUMMARY_MODEL,
+                messages=[
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {"role": "user", "content": f"Summary so far: {previous}\n\nNew turns:\n{lines}"},
+                ],
+                max_tokens=SUMMARY_MAX_TOKENS,
+                temperature=0,
+            )
+            summary = (response.choices[0].message.content or "").strip()
+            history = self.session.history
+            if not summary or len(history) < len(older) or any(a is not b for a, b in zip(history, older)):
+                # History moved underneath us (cleared or trimmed); try again next turn
+                registry.inc("voice_context_summaries_total", result="stale")
+                return
+            await self.session.fold(len(older), summary)
+            registry.inc("voice_context_summaries_total", result="folded")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            registry.inc("voice_context_summaries_total", result="error")
+            print(f"[CONTEXT] Summary failed for {self.session.sid}: {e}")
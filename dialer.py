@@ -0,0 +1,325 @@
+"""
+Outbound campaign dialer. Leads wait in a Redis sorted set scored by when
+they are next due; the dialer pops due leads and places calls into the
+/voice-greeting flow under a calls-per-second limit and a cap on calls in
+progress. Twilio's status callback (/dialer/status) closes each attempt and
+reschedules busy, no-answer and answering-machine outcomes with backoff.
+
+    python dialer.py enqueue leads.csv     # phone[,name] per line
+    python dialer.py run
+    python dialer.py stats
+
+Redis keys:
+    dialer:queue            ZSET lead id -> epoch seconds when due
+    dialer:lead:<id>        HASH phone, name, state, attempts, last_outcome, call_sid, updated_at
+    dialer:active           ZSET call SID -> epoch seconds placed (calls in progress)
+    dialer:call:<call sid>  lead id, until the call's final status arrives
+"""
+import os
+import re
+import csv
+import sys
+import time
+import random
+import asyncio
+from collections import deque
+from session_store import get_async_redis
+from metrics import registry
+
+# --- ENV VARS
+TWILIO_ACCOUNT_SID = os.environ.get("TWILIO_ACCOUNT_SID")
+TWILIO_AUTH_TOKEN = os.environ.get("TWILIO_AUTH_TOKEN")
+TWILIO_FROM_NUMBER = os.environ.get("TWILIO_FROM_NUMBER")
+# Overridden to point the dialer at a local fake of the Twilio REST API
+TWILIO_API_BASE_URL = os.environ.get("TWILIO_API_BASE_URL")
+PUBLIC_BASE_URL = os.environ.get("PUBLIC_BASE_URL", "https://voice-ai-caller.onrender.com")
+# Twilio's default outbound limit is 1 call per second per account
+DIALER_CPS = float(os.environ.get("DIALER_CPS", 1))
+# Calls in progress across all workers; keep within what the web tier can carry
+DIALER_MAX_CONCURRENT = int(os.environ.get("DIALER_MAX_CONCURRENT", 20))
+DIALER_MAX_ATTEMPTS = int(os.environ.get("DIALER_MAX_ATTEMPTS", 3))
+# Multiplies every retry delay (benchmarks shrink it to milliseconds)
+DIALER_RETRY_SCALE = float(os.environ.get("DIALER_RETRY_SCALE", 1))
+# A call with no final status after this long no longer counts as in progress
+DIALER_CALL_MAX_S = int(os.environ.get("DIALER_CALL_MAX_S", 1800))
+DIALER_REPORT_S = int(os.environ.get("DIALER_REPORT_S", 30))
+
+QUEUE_KEY = "dialer:queue"
+ACTIVE_KEY = "dialer:active"
+LEAD_PREFIX = "dialer:lead:"
+CALL_PREFIX = "dialer:call:"
+
+# Seconds before the first retry, doubled for each further attempt
+RETRY_DELAYS = {"busy": 300, "no-answer": 1800, "machine": 3600}
+# Final CallStatus values; anything else is an intermediate event
+FINAL_STATUSES = ("completed", "busy", "no-answer", "failed", "canceled")
+MACHINE_ANSWERS = ("machine_start", "machine_end_beep", "machine_end_silence",
+                   "machine_end_other", "machine", "fax")
+
+_NON_DIGIT = re.compile(r"[^\d+]")
+
+registry.describe("voice_dialer_outcomes_total", "Outbound dialer call attempts by outcome")
+
+
+def normalize_phone(phone):
+    phone = _NON_DIGIT.sub("", phone or "")
+    if phone and not phone.startswith("+"):
+        phone = "+1" + phone if len(phone) == 10 else "+" + phone
+    return phone
+
+
+def classify_outcome(call_status, answered_by=None):
+    if call_status == "completed" and (answered_by or "").lower() in MACHINE_ANSWERS:
+        return "machine"
+    return call_status
+
+
+def retry_delay(outcome, attempts):
+    delay = RETRY_DELAYS[outcome] * 2 ** max(0, attempts - 1) * DIALER_RETRY_SCALE
+    return delay * random.uniform(0.9, 1.1)
+
+
+def handle_status_callback(r, values):
+    """
+    Closes a dialer call attempt from Twilio's final status callback (sync
+    Redis client; runs in the Flask route). Returns the outcome, or None for
+    calls the dialer did not place and for repeated callbacks.
+    """
+    call_sid = values.get("CallSid")
+    status = values.get("CallStatus")
+    if not call_sid or status not in FINAL_STATUSES:
+        return None
+    pipe = r.pipeline()
+    pipe.get(CALL_PREFIX + call_sid)
+    pipe.delete(CALL_PREFIX + call_sid)
+    pipe.zrem(ACTIVE_KEY, call_sid)
+    lead_id = pipe.execute()[0]
+    if lead_id is None:
+        return None
+    lead_id = lead_id.decode() if isinstance(lead_id, bytes) else lead_id
+    lead_key = LEAD_PREFIX + lead_id
+    outcome = classify_outcome(status, values.get("AnsweredBy"))
+    attempts = int(r.hget(lead_key, "attempts") or 0)
+    now = time.time()
+    pipe = r.pipeline()
+    if outcome in RETRY_DELAYS and attempts < DIALER_MAX_ATTEMPTS:
+        state = "retry_wait"
+        pipe.zadd(QUEUE_KEY, {lead_id: now + retry_delay(outcome, attempts)})
+    elif outcome in RETRY_DELAYS:
+        state = "exhausted"
+    else:
+        state = outcome
+    pipe.hset(lead_key, mapping={"state": state, "last_outcome": outcome, "updated_at": now})
+    pipe.execute()
+    registry.inc("voice_dialer_outcomes_total", outcome=outcome)
+    return outcome
+
+
+def valid_twilio_signature(url, params, signature):
+    """
+    True when X-Twilio-Signature shows Twilio sent this request. The URL as
+    received and the callback URL the dialer registers are both accepted,
+    since a proxy in front of the app may change the scheme or host.
+    """
+    if not TWILIO_AUTH_TOKEN or not signature:
+        return False
+    from twilio.request_validator import RequestValidator
+    validator = RequestValidator(TWILIO_AUTH_TOKEN)
+    return any(validator.validate(candidate, params, signature)
+               for candidate in (url, f"{PUBLIC_BASE_URL.rstrip('/')}/dialer/status"))
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Dialer:
+    def __init__(self, redis_client=None, twilio_client=None, cps=DIALER_CPS,
+                 max_concurrent=DIALER_MAX_CONCURRENT, base_url=PUBLIC_BASE_URL, poll_s=0.5):
+        self.redis = redis_client or get_async_redis()
+        self.twilio = twilio_client
+        self.bucket = TokenBucket(cps)
+        self.max_concurrent = max_concurrent
+        self.base_url = base_url.rstrip("/")
+        self.poll_s = poll_s
+        self.placing = set()
+        self.placed_at = deque()
+
+    async def enqueue(self, leads):
+        # leads: iterable of (phone, name); a number already known is left as it is
+        leads = [(normalize_phone(phone), name) for phone, name in leads]
+        leads = [(lead_id, name) for lead_id, name in leads if lead_id]
+        pipe = self.redis.pipeline(transaction=False)
+        for lead_id, name in leads:
+            pipe.hsetnx(LEAD_PREFIX + lead_id, "state", "queued")
+        created = await pipe.execute()
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        added = 0
+        for (lead_id, name), new in zip(leads, created):
+            if new:
+                pipe.hset(LEAD_PREFIX + lead_id, mapping={"phone": lead_id, "name": name or "",
+                                                          "attempts": 0, "updated_at": now})
+                pipe.zadd(QUEUE_KEY, {lead_id: now})
+                added += 1
+        await pipe.execute()
+        return added
+
+    async def run(self, stop=None):
+        stop = stop or asyncio.Event()
+        if self.twilio is None:
+            self.twilio = make_twilio_client()
+        reporter = asyncio.create_task(self._report(stop))
+        try:
+            while not stop.is_set():
+                if not await self._has_capacity():
+                    await asyncio.sleep(self.poll_s)
+                    continue
+                lead_id = await self._next_due()
+                if lead_id is None:
+                    await asyncio.sleep(self.poll_s)
+                    continue
+                await self.bucket.acquire()
+                # The REST call takes longer than 1/CPS, so it runs alongside the loop
+                task = asyncio.create_task(self._place(lead_id))
+                self.placing.add(task)
+                task.add_done_callback(self.placing.discard)
+        finally:
+            stop.set()
+            if self.placing:
+                await asyncio.gather(*self.placing, return_exceptions=True)
+            await reporter
+
+    async def stats(self):
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zcard(QUEUE_KEY)
+        pipe.zcount(QUEUE_KEY, "-inf", now)
+        pipe.zcard(ACTIVE_KEY)
+        total, due, active = await pipe.execute()
+        cutoff = time.monotonic() - 60
+        while self.placed_at and self.placed_at[0] < cutoff:
+            self.placed_at.popleft()
+        return {"queued": total, "due": due, "active": active, "calls_per_min": len(self.placed_at)}
+
+    async def _has_capacity(self):
+        pipe = self.redis.pipeline(transaction=False)
+        # Calls whose final status never arrived stop holding a slot eventually
+        pipe.zremrangebyscore(ACTIVE_KEY, "-inf", time.time() - DIALER_CALL_MAX_S)
+        pipe.zcard(ACTIVE_KEY)
+        _, active = await pipe.execute()
+        return active + len(self.placing) < self.max_concurrent
+
+    async def _next_due(self):
+        popped = await self.redis.zpopmin(QUEUE_KEY)
+        if not popped:
+            return None
+        lead_id, due = popped[0]
+        lead_id = lead_id.decode() if isinstance(lead_id, bytes) else lead_id
+        if due > time.time():
+            # Earliest lead is still backing off; put it back untouched
+            await self.redis.zadd(QUEUE_KEY, {lead_id: due}, nx=True)
+            return None
+        return lead_id
+
+    async def _place(self, lead_id):
+        from twilio.base.exceptions import TwilioRestException
+        lead_key = LEAD_PREFIX + lead_id
+        attempts = await self.redis.hincrby(lead_key, "attempts", 1)
+        await self.redis.hset(lead_key, mapping={"state": "dialing", "updated_at": time.time()})
+        try:
+            call = await self.twilio.calls.create_async(
+                to=lead_id,
+                from_=TWILIO_FROM_NUMBER,
+                url=f"{self.base_url}/voice-greeting",
+                machine_detection="Enable",
+                status_callback=f"{self.base_url}/dialer/status",
+                status_callback_event=["completed"],
+            )
+        except TwilioRestException as e:
+            if e.status == 429 or e.status >= 500:
+                # Throttled or Twilio trouble: the attempt does not count, try again shortly
+                pipe = self.redis.pipeline(transaction=False)
+                pipe.hincrby(lead_key, "attempts", -1)
+                pipe.hset(lead_key, mapping={"state": "queued", "updated_at": time.time()})
+                pipe.zadd(QUEUE_KEY, {lead_id: time.time() + 30 * DIALER_RETRY_SCALE})
+                await pipe.execute()
+            else:
+                await self.redis.hset(lead_key, mapping={"state": "failed", "last_outcome": f"rejected:{e.code}",
+                                                         "updated_at": time.time()})
+            print(f"[DIALER] Call to {lead_id} rejected: {e.status} {e.msg}")
+            return
+        except Exception as e:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hset(lead_key, mapping={"state": "queued", "updated_at": time.time()})
+            pipe.zadd(QUEUE_KEY, {lead_id: time.time() + 30 * DIALER_RETRY_SCALE})
+            await pipe.execute()
+            print(f"[DIALER] Call to {lead_id} failed to start: {e}")
+            return
+        self.placed_at.append(time.monotonic())
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.set(CALL_PREFIX + call.sid, lead_id, ex=DIALER_CALL_MAX_S * 2)
+        pipe.zadd(ACTIVE_KEY, {call.sid: time.time()})
+        pipe.hset(lead_key, mapping={"state": "in_progress", "call_sid": call.sid, "updated_at": time.time()})
+        await pipe.execute()
+        print(f"[DIALER] Calling {lead_id} (attempt {attempts}). Call SID: {call.sid}")
+
+    async def _report(self, stop):
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), DIALER_REPORT_S)
+            except asyncio.TimeoutError:
+                pass
+            s = await self.stats()
+            print(f"[DIALER] {s['calls_per_min']} calls/min, queue {s['queued']} ({s['due']} due), "
+                  f"{s['active']} in progress")
+
+
+def make_twilio_client():
+    # Imported here so the web workers, which only need handle_status_callback, skip the Twilio SDK
+    from twilio.rest import Client
+    from twilio.http.async_http_client import AsyncTwilioHttpClient
+    client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, http_client=AsyncTwilioHttpClient())
+    if TWILIO_API_BASE_URL:
+        client.api.base_url = TWILIO_API_BASE_URL
+    return client
+
+
+def read_leads(path):
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if row and row[0].strip() and not row[0].strip().lower().startswith("phone"):
+                yield row[0].strip(), (row[1].strip() if len(row) > 1 else "")
+
+
+async def main(argv):
+    dialer = Dialer()
+    command = argv[1] if len(argv) > 1 else "run"
+    if command == "enqueue":
+        print(f"[DIALER] Queued {await dialer.enqueue(read_leads(argv[2]))} lead(s)")
+    elif command == "stats":
+        print(await dialer.stats())
+    else:
+        dialer.twilio = make_twilio_client()
+        try:
+            await dialer.run()
+        finally:
+            await dialer.twilio.http_client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv))
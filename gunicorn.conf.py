@@ -0,0 +1,15 @@
+# Production serving: N pre-forked workers, each running server.create_app
+# (TwiML hooks + /ws media stream) on the same port.
+#   gunicorn -c gunicorn.conf.py server:create_app
+import os
+import multiprocessing
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "aiohttp.GunicornWebWorker"
+# Lets a new master bind the port while the old one is still draining
+reuse_port = True
+# Workers get DRAIN_TIMEOUT to let live calls hang up before being killed
+graceful_timeout = int(os.environ.get("DRAIN_TIMEOUT", 120)) + 10
+timeout = 60
+keepalive = 75
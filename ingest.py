@@ -0,0 +1,168 @@
+"""
+Inbound audio path from Twilio to AssemblyAI. Twilio sends one JSON media
+event per 20 ms frame; instead of decoding and forwarding each one, the
+ingest stage:
+
+- pulls the base64 payload out of media events without a full JSON parse
+  (orjson, when installed, handles the other events)
+- decodes frames into a preallocated batch buffer and ships INGEST_BATCH_MS
+  of audio per ASR message
+- drops batches of silence once the caller has been quiet for
+  INGEST_HANGOVER_MS, keeping the last one as pre-roll for the next onset
+  and sending a keepalive batch every INGEST_KEEPALIVE_MS
+
+Per-call CPU time, bytes and message counts are kept in AudioIngest.stats
+and exported as voice_ingest_* counters. The stage never awaits, so its
+wall time (one perf_counter pair per message) is its CPU time; thread CPU
+clocks would cost a syscall each.
+"""
+import os
+import json
+import time
+import audioop
+import binascii
+from metrics import registry
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+# --- ENV VARS
+INGEST_BATCH_MS = int(os.environ.get("INGEST_BATCH_MS", 100))
+INGEST_VAD = os.environ.get("INGEST_VAD", "1") == "1"
+# RMS of the 16-bit decoded batch that counts as speech
+INGEST_VAD_RMS = int(os.environ.get("INGEST_VAD_RMS", 300))
+# Silence kept flowing after speech; must exceed AssemblyAI's end-of-utterance
+# silence threshold (700 ms by default) or finals would never arrive
+INGEST_HANGOVER_MS = int(os.environ.get("INGEST_HANGOVER_MS", 1000))
+# AssemblyAI drops realtime sessions that stop receiving audio altogether
+INGEST_KEEPALIVE_MS = int(os.environ.get("INGEST_KEEPALIVE_MS", 5000))
+
+SAMPLE_RATE = 8000
+MEDIA_PREFIX = '{"event":"media"'
+PAYLOAD_MARKER = '"payload":"'
+
+registry.describe("voice_ingest_bytes_total", "Caller audio bytes received from Twilio and sent to ASR")
+registry.describe("voice_ingest_messages_total", "WebSocket messages received from Twilio and sent to ASR")
+registry.describe("voice_ingest_cpu_seconds_total", "CPU seconds spent parsing, decoding and gating caller audio")
+
+
+def media_payload(message):
+    """Base64 payload of a Twilio media event, or None for any other message."""
+    if not message.startswith(MEDIA_PREFIX):
+        return None
+    start = message.find(PAYLOAD_MARKER)
+    if start < 0:
+        return None
+    start += len(PAYLOAD_MARKER)
+    # Base64 never contains a quote, so the payload ends at the next one
+    return message[start:message.index('"', start)]
+
+
+class AudioIngest:
+    def __init__(self, batch_ms=INGEST_BATCH_MS, vad=INGEST_VAD):
+        self.batch_bytes = SAMPLE_RATE * batch_ms // 1000
+        self.buf = bytearray(self.batch_bytes)
+        self.fill = 0
+        self.vad = vad
+        self.audio_ms = 0.0
+        self.last_voice_ms = None
+        self.last_sent_ms = 0.0
+        self.preroll = None
+        self.stats = {"cpu_s": 0.0, "bytes_in": 0, "bytes_sent": 0, "messages_in": 0, "messages_sent": 0,
+                      "batches_suppressed": 0}
+
+    def push(self, message):
+        """
+        Feeds one Twilio message. Returns None if it is not a media event
+        (the caller handles it), otherwise the list of chunks to send to ASR.
+        """
+        started = time.perf_counter()
+        payload = media_payload(message) if isinstance(message, str) else None
+        if payload is None:
+            return None
+        out = self._decode(payload)
+        self.stats["cpu_s"] += time.perf_counter() - started
+        return out
+
+    def push_payload(self, payload):
+        # For media events already parsed by the caller
+        started = time.perf_counter()
+        out = self._decode(payload)
+        self.stats["cpu_s"] += time.perf_counter() - started
+        return out
+
+    def _decode(self, payload):
+        frame = binascii.a2b_base64(payload)
+        self.stats["messages_in"] += 1
+        self.stats["bytes_in"] += len(frame)
+        out = []
+        fill = self.fill
+        if fill == 0 and len(frame) == self.batch_bytes:
+            self._gate(frame, out)
+            return out
+        view = memoryview(frame)
+        while view:
+            take = min(len(view), self.batch_bytes - fill)
+            self.buf[fill:fill + take] = view[:take]
+            fill += take
+            view = view[take:]
+            if fill == self.batch_bytes:
+                self._gate(bytes(self.buf), out)
+                fill = 0
+        self.fill = fill
+        return out
+
+    def flush(self):
+        # End of stream: whatever is left in the buffer goes out as is
+        out = []
+        if self.fill:
+            self._gate(bytes(self.buf[:self.fill]), out)
+            self.fill = 0
+        return out
+
+    def _gate(self, batch, out):
+        batch_ms = len(batch) * 1000 / SAMPLE_RATE
+        self.audio_ms += batch_ms
+        if not self.vad:
+            self._send(batch, out)
+            return
+        if audioop.rms(audioop.ulaw2lin(batch, 2), 2) >= INGEST_VAD_RMS:
+            if self.preroll is not None:
+                # Onset may have started at the end of the last suppressed batch
+                self._send(self.preroll, out)
+            self.last_voice_ms = self.audio_ms
+            self._send(batch, out)
+        elif self.last_voice_ms is not None and self.audio_ms - self.last_voice_ms <= INGEST_HANGOVER_MS:
+            self._send(batch, out)
+        elif self.audio_ms - self.last_sent_ms >= INGEST_KEEPALIVE_MS:
+            self._send(batch, out)
+        else:
+            self.preroll = batch
+            self.stats["batches_suppressed"] += 1
+
+    def _send(self, batch, out):
+        out.append(batch)
+        # A suppressed batch is only worth sending right before the next one; after any
+        # send (keepalive, hangover) it would arrive out of order
+        self.preroll = None
+        self.last_sent_ms = self.audio_ms
+        self.stats["messages_sent"] += 1
+        self.stats["bytes_sent"] += len(batch)
+
+    def record(self, trace):
+        # Call ended: per-call figures onto the trace, totals onto the registry
+        trace.counters.update(
+            ingest_cpu_ms=round(self.stats["cpu_s"] * 1000, 2),
+            ingest_bytes_in=self.stats["bytes_in"],
+            ingest_bytes_sent=self.stats["bytes_sent"],
+            ingest_messages_in=self.stats["messages_in"],
+            ingest_messages_sent=self.stats["messages_sent"],
+        )
+        registry.inc("voice_ingest_bytes_total", self.stats["bytes_in"], direction="received")
+        registry.inc("voice_ingest_bytes_total", self.stats["bytes_sent"], direction="sent_asr")
+        registry.inc("voice_ingest_messages_total", self.stats["messages_in"], direction="received")
+        registry.inc("voice_ingest_messages_total", self.stats["messages_sent"], direction="sent_asr")
+        registry.inc("voice_ingest_cpu_seconds_total", round(self.stats["cpu_s"], 6))
@@ -0,0 +1,101 @@
+"""
+Intent fast path: turns that ask one of a few recurring questions (mostly the
+pricing objection) are answered from a curated reply whose audio was rendered
+at startup, skipping the LLM call and TTS synthesis for that turn.
+"""
+import os
+import re
+from metrics import registry
+from speculation import normalize
+from audio_engine import prompt_cache
+from slot_search import get_zip_index
+from tts_pipeline import synthesize_ulaw, cache_key
+
+# --- ENV VARS
+INTENT_FAST_PATH = os.environ.get("INTENT_FAST_PATH", "1") == "1"
+# Longer utterances usually carry more than the one question; leave those to the LLM
+INTENT_MAX_WORDS = int(os.environ.get("INTENT_MAX_WORDS", 20))
+
+# Digits mean a ZIP, address or time the LLM has to act on
+_HAS_DIGITS = re.compile(r"\d")
+# So do days and times of day: "can you come Tuesday morning" is a booking turn
+_NAMES_WHEN = re.compile(
+    r"\b(?:monday|tuesday|wednesday|thursday|friday|saturday|sunday|weekend|today|tonight|tomorrow|"
+    r"next week|this week|morning|afternoon|evening|noon|oclock)\b")
+
+
+class Intent:
+    def __init__(self, name, keywords, reply):
+        self.name = name
+        self.pattern = re.compile(r"\b(?:%s)\b" % "|".join(re.escape(k) for k in keywords))
+        self.reply = reply
+        # Rendered audio is keyed by the reply and voice, so editing either re-renders it
+        self.audio_key = f"intent_{name}_{cache_key(reply)[:12]}"
+
+    def matches(self, text):
+        return self.pattern.search(text) is not None
+
+
+INTENTS = (
+    Intent(
+        "pricing",
+        # Only phrases that ask for a price: "how much notice" or "does it cost anything" are not
+        ("how much does it cost", "how much would it cost", "how much will it cost", "how much do you charge",
+         "what do you charge", "price", "prices", "pricing", "ballpark", "your rates", "rough estimate",
+         "estimate over the phone"),
+        "We actually never give prices or ballpark estimates over the phone because every home is different. "
+        "We don't like to play the add-on or upcharge game. So whatever price we give you will stay there. "
+        "We take pride in doing things the right way. What day works best for you to have one of our experts come out?",
+    ),
+    Intent(
+        "experience",
+        ("how long have you been", "how long you been", "how many years", "been in business"),
+        "We've been in business for 37 years, and we're backed by a 5 star review rating on all platforms. "
+        "Would you like to set up a free in-person estimate?",
+    ),
+)
+
+registry.describe("voice_intent_fast_path_total", "Turns checked against the canned-answer intent table, by result")
+
+
+def classify(transcript):
+    text = normalize(transcript)
+    if not text or len(text.split()) > INTENT_MAX_WORDS or _HAS_DIGITS.search(text) or _NAMES_WHEN.search(text):
+        return None
+    if get_zip_index().city_zip(text):
+        # A city is a location the LLM should pick up for the booking
+        return None
+    for intent in INTENTS:
+        if intent.matches(text):
+            return intent
+    return None
+
+
+def fast_path(transcript, history):
+    """Returns (intent, frames) when the turn can be answered from the canned cache, else None."""
+    if not INTENT_FAST_PATH:
+        return None
+    intent = classify(transcript)
+    if intent is None:
+        registry.inc("voice_intent_fast_path_total", result="miss")
+        return None
+    if any(msg.get("role") == "assistant" and msg.get("content") == intent.reply for msg in history):
+        # Asked again: a word-for-word repeat sounds robotic, let the LLM rephrase
+        registry.inc("voice_intent_fast_path_total", result="repeat", intent=intent.name)
+        return None
+    frames = prompt_cache.get(intent.audio_key)
+    if frames is None:
+        registry.inc("voice_intent_fast_path_total", result="not_rendered", intent=intent.name)
+        return None
+    registry.inc("voice_intent_fast_path_total", result="hit", intent=intent.name)
+    return intent, frames
+
+
+def warm():
+    # Blocking: renders (or reloads from static/prompts) each reply's audio
+    for intent in INTENTS:
+        try:
+            frames = prompt_cache.load(intent.audio_key, render=lambda: synthesize_ulaw(intent.reply))
+            print(f"[INTENTS] Cached reply '{intent.name}': {len(frames)} frames")
+        except Exception as e:
+            print(f"[INTENTS] Failed to render reply '{intent.name}': {e}")
@@ -1,368 +1,556 @@
-import os
-import uuid
-import json
-import datetime
-import requests
-import openai
-import re
-import redis
-import random
-import concurrent.futures
-import time
-import dateutil.parser
-import asyncio
-import websockets
-import base64
-from flask import Flask, request, Response, redirect
-from flask_session import Session
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
-
-# --- ENV VARS
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-ELEVENLABS_API_KEY = os.environ.get("ELEVENLABS_API_KEY")
-ELEVENLABS_VOICE_ID = os.environ.get("ELEVENLABS_VOICE_ID")
-ASSEMBLYAI_API_KEY = os.environ.get("ASSEMBLYAI_API_KEY")
-GOOGLE_TOKEN = os.environ.get("GOOGLE_TOKEN")
-REDIS_URL = os.environ.get("REDIS_URL")
-TWILIO_ACCOUNT_SID = os.environ.get("TWILIO_ACCOUNT_SID")
-TWILIO_AUTH_TOKEN = os.environ.get("TWILIO_AUTH_TOKEN")
-TWILIO_FROM_NUMBER = os.environ.get("TWILIO_FROM_NUMBER")
-OWNER_PHONE_NUMBER = os.environ.get("OWNER_PHONE_NUMBER")
-
-SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
-city_to_zip = {
-    "houston": "77002", "sugar land": "77479", "katy": "77494",
-    "the woodlands": "77380", "cypress": "77429", "bellaire": "77401", "tomball": "77375"
-}
-
-redis_client = redis.from_url(REDIS_URL)
-executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
-
-GREETING_MP3_URL = "https://files.catbox.moe/tajfjq.mp3"
-CLOSING_MP3_URL = "https://files.catbox.moe/w4f2tu.mp3"
-
-# --- FLASK APP FOR TWILIO HOOKS
-app = Flask(__name__)
-app.config['SESSION_TYPE'] = 'filesystem'
-Session(app)
-os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
-
-# ---- MEMORY/BOOKING LOGIC PRESERVED FROM YOUR OLD main.py
-
-def format_event_time(dt_str):
-    try:
-        dt = dateutil.parser.parse(dt_str)
-        day_suffix = lambda d: 'th' if 11<=d<=13 else {1:'st',2:'nd',3:'rd'}.get(d%10, 'th')
-        formatted_date = dt.strftime(f"%A, %B {dt.day}{day_suffix(dt.day)} at %-I:%M %p")
-        return formatted_date
-    except Exception as e:
-        print(f"Failed to format event time: {dt_str} - {e}")
-        return dt_str
-
-def get_calendar_zip_matches(user_zip, events):
-    matches = []
-    for event in events:
-        location = event.get('location', '')
-        match = re.search(r'\b77\d{3}\b', location)
-        if match and match.group(0) == user_zip:
-            start = event['start'].get('dateTime', event['start'].get('date'))
-            matches.append(start)
-    return matches
-
-def load_credentials():
-    print("ENTER load_credentials()")
-    token_json = os.environ.get("GOOGLE_TOKEN")
-    if not token_json:
-        print("❌ No GOOGLE_TOKEN environment variable found.")
-        return None
-    try:
-        data = json.loads(token_json)
-        creds = Credentials.from_authorized_user_info(data, SCOPES)
-        return creds
-    except Exception as e:
-        print("❌ Failed to load credentials from GOOGLE_TOKEN:", e)
-        return None
-
-def load_conversation(sid):
-    key = f"history:{sid}"
-    data = redis_client.get(key)
-    return json.loads(data.decode()) if data else []
-
-def save_conversation(sid, history):
-    key = f"history:{sid}"
-    if len(history) > 15:
-        history = history[:1] + history[-15:]
-    redis_client.set(key, json.dumps(history), ex=3600)
-
-def clear_conversation(sid):
-    key = f"history:{sid}"
-    redis_client.delete(key)
-
-def text_booking_to_owner(date_time, address, phone, notes=None):
-    try:
-        if not (TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN and TWILIO_FROM_NUMBER and OWNER_PHONE_NUMBER):
-            print("Twilio SMS notification vars not all set!")
-            return False
-        from twilio.rest import Client
-        client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-        message = (
-            f"🗓️ New Air Duct Estimate Booking!\n"
-            f"Address: {address}\n"
-            f"Date/Time: {date_time}\n"
-            f"Phone: {phone}\n"
-        )
-        if notes:
-            message += f"Notes: {notes}"
-        client.messages.create(
-            to=OWNER_PHONE_NUMBER,
-            from_=TWILIO_FROM_NUMBER,
-            body=message
-        )
-        print("Texted booking to owner successfully.")
-        return True
-    except Exception as e:
-        print(f"Failed to send booking SMS: {e}")
-        return False
-
-def get_ai_functions():
-    return [
-        {
-            "name": "book_estimate",
-            "description": "Books a free in-person estimate for air duct cleaning. Only call this function when you have confirmed the customer's ZIP, full address, and agreed upon appointment date/time.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "zip_code": {"type": "string", "description": "ZIP code"},
-                    "address": {"type": "string", "description": "Full street address including city and ZIP"},
-                    "date_time": {"type": "string", "description": "Confirmed appointment date and time, e.g. 'Tuesday, June 4th at 10:00 AM'"},
-                },
-                "required": ["zip_code", "address", "date_time"]
-            }
-        }
-    ]
-
-# ---- GREETING HOOK (TWILIO POINTS TO THIS BEFORE MEDIA STREAM)
-@app.route("/voice-greeting", methods=["POST", "GET"])
-def voice_greeting():
-    sid = request.values.get("CallSid") or request.values.get("sid") or request.args.get("sid") or str(uuid.uuid4())
-    answered_by = (request.values.get("AnsweredBy") or "").lower()
-    if answered_by in ["machine", "fax", "unknown_machine"]:
-        return redirect("/voicemail", code=307)
-    return Response(f"""
-    <Response>
-        <Play>https://files.catbox.moe/tajfjq.mp3</Play>
-        <Start>
-            <Stream url="wss://{request.host}/ws?sid={sid}" />
-        </Start>
-    </Response>
-    """, mimetype="application/xml")
-
-@app.route("/voicemail", methods=["POST", "GET"])
-def voicemail_route():
-    voicemail_url = "https://files.catbox.moe/0ugvt7.mp3"
-    return Response(f"""
-    <Response>
-        <Play>{voicemail_url}</Play>
-        <Hangup/>
-    </Response>
-    """, mimetype="application/xml")
-
-@app.route("/", methods=["GET"])
-def root():
-    return "Nick AI Voice Agent is running."
-
-# --- ASYNC WEBSOCKET SERVER FOR TWILIO MEDIA STREAMS
-# --- (Runs in the same process as Flask for Render deployment)
-
-async def process_media_stream(websocket, path):
-    # Extract SID for conversation memory
-    query = websocket.path.split("?")
-    sid = None
-    if len(query) > 1:
-        from urllib.parse import parse_qs
-        params = parse_qs(query[1])
-        sid = params.get("sid", [str(uuid.uuid4())])[0]
-    else:
-        sid = str(uuid.uuid4())
-    caller_number = None
-
-    print(f"[WS] New Twilio media stream. SID={sid}")
-
-    # Set up AssemblyAI real-time session
-    aai_url = "wss://api.assemblyai.com/v2/realtime/ws?sample_rate=8000"
-    headers = {"Authorization": ASSEMBLYAI_API_KEY}
-    async with websockets.connect(aai_url, extra_headers=headers) as aai_ws:
-        async def send_to_assemblyai():
-            async for message in websocket:
-                try:
-                    msg = json.loads(message)
-                    if msg["event"] == "start":
-                        caller_number = msg.get("start", {}).get("call_sid")
-                        print(f"[WS] Start event. Caller: {caller_number}")
-                    elif msg["event"] == "media":
-                        audio = base64.b64decode(msg["media"]["payload"])
-                        await aai_ws.send(audio)
-                except Exception as e:
-                    print("[WS] Error forwarding to AssemblyAI:", e)
-
-        async def receive_from_assemblyai():
-            transcript_buf = ""
-            async for msg in aai_ws:
-                try:
-                    data = json.loads(msg)
-                    if "text" in data and data["message_type"] == "FinalTranscript":
-                        transcript = data["text"].strip()
-                        if transcript:
-                            print(f"[WS] Transcript: {transcript}")
-                            # Save to memory
-                            history = load_conversation(sid)
-                            history.append({"role": "user", "content": transcript})
-                            save_conversation(sid, history)
-
-                            # Check for ZIP in transcript
-                            zip_found = re.search(r'\b77\d{3}\b', transcript)
-                            if zip_found:
-                                redis_client.set(f"zip:{sid}", zip_found.group(0), ex=900)
-                            if caller_number:
-                                redis_client.set(f"phone:{sid}", caller_number, ex=900)
-
-                            # --- Compose prompt (preserve your logic)
-                            SYSTEM_PROMPT = {
-                                "role": "system",
-                                "content": (
-                                    "You are a helpful sales assistant for a premium high end air duct cleaning company that has been in business for 37 years. ",
-        "Backed by our 5 star review rating on all platforms, we are the most high end air quality company you can find. ",
-        "We are a state licensed mold remediation contractor, & we do dryer vent cleaning for free when we clean the HVAC system as well. Respond conversationally & professionally. ",
-        "Great customer service is very important. If it is an outbound call then your goal should be to book them for a free estimate by asking for their ZIP code. ",
-        "Then cross reference our google calendar to find a time we will be in their area. If it is an inbound call & they say they are looking to get a quote, price, or estimate, your goal should be to book an estimate.",
-        "UNDER NO CIRCUMSTANCES should you ever give a price, quote, average, ballpark, or estimate over the phone or via text. ",
-        "If the customer asks for a price, quote, estimate, or ballpark, politely explain that our company policy is to do a free in-person inspection so we can give the most accurate, customized estimate based on the specific needs of their home. We don't like to play the add-on or upcharge game. Whatever price we give you will stay there!",
-        "Always redirect the conversation toward booking a free in-person estimate, never giving any numbers. ",
-        "Sample response: 'We actually never give prices or ballpark estimates over the phone because every home is different. We don't like to play the add-on or upcharge game. So whatever price we give you will stay there. We take pride in doing things the right way. What day works best for you to have one of our experts come out?'",
-                                )
-                            }
-                            user_zip = redis_client.get(f"zip:{sid}")
-                            user_zip = user_zip.decode() if user_zip else None
-                            messages = [SYSTEM_PROMPT] + [msg for msg in history if msg.get("role") != "system"]
-
-                            # Calendar prompt injection (if applicable)
-                            if user_zip:
-                                creds = load_credentials()
-                                if creds and creds.expired and creds.refresh_token:
-                                    creds.refresh(Request())
-                                service = build('calendar', 'v3', credentials=creds)
-                                now = datetime.datetime.utcnow().isoformat() + 'Z'
-                                events = service.events().list(calendarId='primary', timeMin=now,
-                                                               maxResults=10, singleEvents=True,
-                                                               orderBy='startTime').execute().get('items', [])
-                                matches = get_calendar_zip_matches(user_zip, events)
-                                formatted_times = [format_event_time(dt) for dt in matches[:2]]
-                                if formatted_times:
-                                    calendar_prompt = f"We’ll already be in your area ({user_zip}) at {', '.join(formatted_times)}. Would one of those work for a free estimate?"
-                                else:
-                                    calendar_prompt = f"We’re not currently scheduled in {user_zip}, but I can open up time for you. What day & time works best?"
-                                messages.append({"role": "assistant", "content": calendar_prompt})
-
-                            # --- GPT-4o streaming call
-                            openai.api_key = OPENAI_API_KEY
-                            ai_functions = get_ai_functions()
-                            response = openai.chat.completions.create(
-                                model="gpt-4o",
-                                messages=messages,
-                                functions=ai_functions,
-                                function_call="auto",
-                                stream=True
-                            )
-                            reply_text = ""
-                            function_called = None
-                            fn_args = {}
-                            for chunk in response:
-                                if hasattr(chunk.choices[0].delta, "content"):
-                                    content = chunk.choices[0].delta.content
-                                    if content:
-                                        reply_text += content
-                                        # --- Stream to ElevenLabs as we go
-                                        await elevenlabs_stream_tts(content, websocket)
-                                if hasattr(chunk.choices[0].delta, "function_call"):
-                                    function_called = chunk.choices[0].delta.function_call.name
-                                    fn_args = json.loads(chunk.choices[0].delta.function_call.arguments)
-
-                            # Function-calling logic
-                            if function_called == "book_estimate":
-                                redis_client.set(f"zip:{sid}", fn_args["zip_code"], ex=900)
-                                redis_client.set(f"address:{sid}", fn_args["address"], ex=900)
-                                redis_client.set(f"time:{sid}", fn_args["date_time"], ex=900)
-                                redis_client.set(f"notified:{sid}", "1", ex=1800)
-                                text_booking_to_owner(fn_args["date_time"], fn_args["address"], caller_number)
-                                reply_text = (
-                                    f"You're all set! We have you down for a free estimate at {fn_args['address']} on {fn_args['date_time']}. "
-                                    "We'll send you a confirmation shortly. Thank you!"
-                                )
-                                await elevenlabs_stream_tts(reply_text, websocket)
-                                # Play closing MP3
-                                await stream_mp3_to_twilio(CLOSING_MP3_URL, websocket)
-
-                            # Save assistant message
-                            history = load_conversation(sid)
-                            history.append({"role": "assistant", "content": reply_text})
-                            save_conversation(sid, history)
-
-                except Exception as e:
-                    print("[WS] Error in AssemblyAI recv:", e)
-
-        async def elevenlabs_stream_tts(text, twilio_ws):
-            if not text.strip():
-                return
-            url = f"https://api.elevenlabs.io/v1/text-to-speech/{ELEVENLABS_VOICE_ID}/stream"
-            headers = {
-                "xi-api-key": ELEVENLABS_API_KEY,
-                "Content-Type": "application/json"
-            }
-            body = {
-                "text": text,
-                "voice_settings": {"stability": 0.5, "similarity_boost": 0.7},
-                "model_id": "eleven_multilingual_v2"
-            }
-            resp = requests.post(url, headers=headers, json=body, stream=True)
-            chunk_size = 2048
-            for chunk in resp.iter_content(chunk_size=chunk_size):
-                if chunk:
-                    media_msg = {
-                        "event": "media",
-                        "media": {"payload": base64.b64encode(chunk).decode()}
-                    }
-                    await twilio_ws.send(json.dumps(media_msg))
-
-        async def stream_mp3_to_twilio(mp3_url, twilio_ws):
-            # Download MP3 and send chunks as Twilio media events
-            resp = requests.get(mp3_url, stream=True)
-            for chunk in resp.iter_content(2048):
-                if chunk:
-                    media_msg = {
-                        "event": "media",
-                        "media": {"payload": base64.b64encode(chunk).decode()}
-                    }
-                    await twilio_ws.send(json.dumps(media_msg))
-
-        await asyncio.gather(send_to_assemblyai(), receive_from_assemblyai())
-
-# --- RUN BOTH FLASK (FOR HOOKS) AND WS (FOR MEDIA STREAM) ON RENDER
-def run_flask():
-    port = int(os.environ.get("PORT", 5000))
-    app.run(host="0.0.0.0", port=port)
-
-def run_ws():
-    ws_port = 8765
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    start_server = websockets.serve(process_media_stream, "0.0.0.0", ws_port)
-    loop.run_until_complete(start_server)
-    loop.run_forever()
-
-if __name__ == "__main__":
-    import threading
-    flask_thread = threading.Thread(target=run_flask)
-    flask_thread.start()
-    run_ws()
+import os
+import uuid
+import json
+import re
+import redis
+import time
+import asyncio
+import websockets
+from xml.sax.saxutils import quoteattr
+from flask import Flask, request, Response, redirect
+from tts_pipeline import TTSPipeline, get_http_client, ELEVENLABS_API_URL
+from calendar_service import calendar_availability
+from slot_search import get_zip_index
+from session_store import CallSession, get_async_redis
+from context_window import build_messages, Summarizer
+from metrics import registry, CallTrace, get_call_trace
+from speculation import (SPECULATIVE_MODE, SPECULATION_TTS_PHRASES, PartialStabilizer,
+                         Speculation, TurnGate, normalize, speculation_stats)
+from audio_engine import AudioOut, prompt_cache, GREETING_MP3_URL, VOICEMAIL_MP3_URL
+import intents
+from dialer import handle_status_callback, valid_twilio_signature, MACHINE_ANSWERS
+from outbox import outbox_worker, make_job, JOBS_KEY as OUTBOX_JOBS_KEY
+from ingest import AudioIngest, loads as ingest_loads
+from upstreams import upstreams, make_http_client
+
+# --- ENV VARS
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1")
+ELEVENLABS_API_KEY = os.environ.get("ELEVENLABS_API_KEY")
+ELEVENLABS_VOICE_ID = os.environ.get("ELEVENLABS_VOICE_ID")
+GOOGLE_TOKEN = os.environ.get("GOOGLE_TOKEN")
+REDIS_URL = os.environ.get("REDIS_URL")
+TWILIO_ACCOUNT_SID = os.environ.get("TWILIO_ACCOUNT_SID")
+TWILIO_AUTH_TOKEN = os.environ.get("TWILIO_AUTH_TOKEN")
+TWILIO_FROM_NUMBER = os.environ.get("TWILIO_FROM_NUMBER")
+OWNER_PHONE_NUMBER = os.environ.get("OWNER_PHONE_NUMBER")
+# Words of new caller speech needed before an in-flight reply is cut off
+BARGE_IN_MIN_WORDS = int(os.environ.get("BARGE_IN_MIN_WORDS", 2))
+# Startup waits at most this long for warmup (gunicorn kills a worker silent for 60 s)
+WARMUP_TIMEOUT_S = float(os.environ.get("WARMUP_TIMEOUT_S", 30))
+
+city_to_zip = {
+    "houston": "77002", "sugar land": "77479", "katy": "77494",
+    "the woodlands": "77380", "cypress": "77429", "bellaire": "77401", "tomball": "77375"
+}
+
+_redis_client = None
+_openai_client = None
+_openai_http = None
+
+# --- FLASK APP FOR TWILIO HOOKS
+app = Flask(__name__)
+os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+
+# ---- MEMORY/BOOKING LOGIC PRESERVED FROM YOUR OLD main.py
+
+def format_event_time(dt_str):
+    import dateutil.parser
+    try:
+        dt = dateutil.parser.parse(dt_str)
+        day_suffix = lambda d: 'th' if 11<=d<=13 else {1:'st',2:'nd',3:'rd'}.get(d%10, 'th')
+        formatted_date = dt.strftime(f"%A, %B {dt.day}{day_suffix(dt.day)} at %-I:%M %p")
+        return formatted_date
+    except Exception as e:
+        print(f"Failed to format event time: {dt_str} - {e}")
+        return dt_str
+
+def get_redis_client():
+    # Created on first use: importing main opens no connections
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.from_url(REDIS_URL)
+    return _redis_client
+
+def get_openai_http_client():
+    # Keep-alive pool shared by every call (HTTP/2 when h2 is installed)
+    global _openai_http
+    if _openai_http is None:
+        _openai_http = make_http_client()
+    return _openai_http
+
+def get_openai_client():
+    global _openai_client
+    if _openai_client is None:
+        # The SDK takes about a second to import; warmup() pays for it before traffic
+        import openai
+        _openai_client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=get_openai_http_client())
+    return _openai_client
+
+def start_upstreams():
+    # Warm AssemblyAI sessions, and keep the OpenAI / ElevenLabs connections open
+    upstreams.start(http_targets=[
+        (get_openai_http_client, OPENAI_BASE_URL),
+        (get_http_client, ELEVENLABS_API_URL),
+    ])
+
+def get_ai_functions():
+    return [
+        {
+            "name": "book_estimate",
+            "description": "Books a free in-person estimate for air duct cleaning. Only call this function when you have confirmed the customer's ZIP, full address, and agreed upon appointment date/time.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "zip_code": {"type": "string", "description": "ZIP code"},
+                    "address": {"type": "string", "description": "Full street address including city and ZIP"},
+                    "date_time": {"type": "string", "description": "Confirmed appointment date and time, e.g. 'Tuesday, June 4th at 10:00 AM'"},
+                },
+                "required": ["zip_code", "address", "date_time"]
+            }
+        }
+    ]
+
+# ---- GREETING HOOK (TWILIO POINTS TO THIS BEFORE MEDIA STREAM)
+@app.route("/voice-greeting", methods=["POST", "GET"])
+def voice_greeting():
+    sid = request.values.get("CallSid") or request.values.get("sid") or request.args.get("sid") or str(uuid.uuid4())
+    answered_by = (request.values.get("AnsweredBy") or "").lower()
+    # Same values the dialer counts as machines (machine_start with machine_detection="Enable")
+    if answered_by in MACHINE_ANSWERS:
+        return redirect("/voicemail", code=307)
+    # The caller is the lead we dialed on outbound calls
+    outbound = (request.values.get("Direction") or "").startswith("outbound")
+    caller = request.values.get("To" if outbound else "From") or ""
+    # The greeting plays while this call's ASR session connects
+    upstreams.reserve(sid)
+    # Twilio drops query strings from Stream URLs; <Parameter> values arrive in the start event
+    return Response(f"""
+    <Response>
+        <Play>{GREETING_MP3_URL}</Play>
+        <Connect>
+            <Stream url="wss://{request.host}/ws">
+                <Parameter name="sid" value={quoteattr(sid)} />
+                <Parameter name="caller" value={quoteattr(caller)} />
+            </Stream>
+        </Connect>
+    </Response>
+    """, mimetype="application/xml")
+
+@app.route("/voicemail", methods=["POST", "GET"])
+def voicemail_route():
+    return Response(f"""
+    <Response>
+        <Play>{VOICEMAIL_MP3_URL}</Play>
+        <Hangup/>
+    </Response>
+    """, mimetype="application/xml")
+
+@app.route("/dialer/status", methods=["POST"])
+def dialer_status_route():
+    # Final status of an outbound campaign call: frees its slot, schedules any retry.
+    # Anyone could post here, so only requests signed with our Twilio auth token count
+    if not valid_twilio_signature(request.url, request.form, request.headers.get("X-Twilio-Signature")):
+        return Response(status=403)
+    outcome = handle_status_callback(get_redis_client(), request.form)
+    if outcome:
+        print(f"[DIALER] {request.values.get('CallSid')} -> {outcome}")
+    return Response(status=204)
+
+@app.route("/", methods=["GET"])
+def root():
+    return "Nick AI Voice Agent is running."
+
+@app.route("/metrics", methods=["GET"])
+def metrics_route():
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/metrics/calls/<call_sid>", methods=["GET"])
+def call_trace_route(call_sid):
+    trace = get_call_trace(call_sid)
+    if trace is None:
+        return Response(json.dumps({"error": "unknown call"}), status=404, mimetype="application/json")
+    return Response(json.dumps(trace), mimetype="application/json")
+
+# --- ASYNC WEBSOCKET SERVER FOR TWILIO MEDIA STREAMS
+# --- (Runs in the same process as Flask for Render deployment)
+
+async def read_start(websocket):
+    # Twilio sends "connected", then "start" with the call's identifiers, before any audio
+    async for message in websocket:
+        msg = json.loads(message)
+        if msg.get("event") == "start":
+            return msg.get("start") or {}
+        if msg.get("event") == "stop":
+            break
+    return None
+
+async def process_media_stream(websocket, path):
+    start = await read_start(websocket)
+    if start is None:
+        print("[WS] Media stream closed before its start event")
+        return
+    params = start.get("customParameters") or {}
+    # SID for conversation memory and the ASR session reserved at the greeting webhook
+    sid = params.get("sid") or start.get("callSid") or str(uuid.uuid4())
+    caller_number = params.get("caller") or None
+    audio_out = AudioOut(websocket)
+    audio_out.stream_sid = start.get("streamSid")
+
+    print(f"[WS] New Twilio media stream. SID={sid} Caller: {caller_number}")
+    call_trace = CallTrace(sid)
+    # One Redis round trip for the whole history; turns are served from memory afterwards
+    started = time.perf_counter()
+    session = await CallSession(sid).load()
+    call_trace.stage("redis_load", time.perf_counter() - started)
+    summarizer = Summarizer(session, get_openai_client)
+
+    # AssemblyAI session pre-opened at the greeting webhook, or a warm pooled one
+    aai_ws = await upstreams.acquire_asr(sid)
+
+    async def end_asr():
+        # Ends the AssemblyAI session, which also ends receive_from_assemblyai's loop
+        try:
+            await aai_ws.send(json.dumps({"terminate_session": True}))
+        except websockets.ConnectionClosed:
+            pass
+        await aai_ws.close()
+
+    try:
+        async def send_to_assemblyai():
+            # Batched, silence-gated forwarding of caller audio (see ingest.py)
+            ingest = AudioIngest()
+            try:
+                async for message in websocket:
+                    stopped = False
+                    try:
+                        chunks = ingest.push(message)
+                        if chunks is None:
+                            msg = ingest_loads(message)
+                            if msg["event"] == "media":
+                                chunks = ingest.push_payload(msg["media"]["payload"])
+                            elif msg["event"] == "stop":
+                                chunks = ingest.flush()
+                                stopped = True
+                        for chunk in chunks or ():
+                            await aai_ws.send(chunk)
+                    except Exception as e:
+                        print("[WS] Error forwarding to AssemblyAI:", e)
+                    if stopped:
+                        # Twilio sends stop when the call ends
+                        break
+            except websockets.ConnectionClosed:
+                pass
+            finally:
+                ingest.record(call_trace)
+
+        current_turn = None
+
+        async def answer_from_cache(gate, trace, intent, frames):
+            # Canned reply with pre-rendered audio: no LLM call, no TTS request
+            await gate.wait()
+            print(f"[WS] Transcript: {gate.transcript} (fast path: {intent.name})")
+            audio_out.on_next_frame = lambda: trace.mark("first_media_sent")
+            playback = asyncio.create_task(audio_out.play_frames(frames))
+            try:
+                session.append("assistant", intent.reply)
+                started = time.perf_counter()
+                await asyncio.shield(session.commit())
+                trace.stage("redis_commit", time.perf_counter() - started)
+                summarizer.maybe_start()
+                await playback
+            except BaseException:
+                playback.cancel()
+                raise
+            trace.finish()
+
+        async def run_turn(gate, trace):
+            # Everything before gate.wait() is side-effect free, so a turn started
+            # speculatively from a partial transcript can be thrown away
+            try:
+                transcript = gate.transcript
+                canned = intents.fast_path(transcript, session.history)
+                if canned:
+                    await answer_from_cache(gate, trace, *canned)
+                    return
+                zip_found = re.search(r'\b77\d{3}\b', transcript)
+                user_zip = zip_found.group(0) if zip_found else session.slots.get("zip")
+                if not user_zip:
+                    # "I'm out in Katy": search around the city's ZIP until the caller gives theirs
+                    user_zip = get_zip_index().city_zip(transcript, city_to_zip)
+                # Constant system prompt, call state, and as much recent history as the budget allows
+                messages = build_messages(session, transcript)
+
+                # Calendar prompt injection (if applicable)
+                if user_zip:
+                    started = time.perf_counter()
+                    matches = calendar_availability.open_slots(user_zip)
+                    trace.stage("calendar_lookup", time.perf_counter() - started)
+                    if matches is not None:
+                        formatted_times = [format_event_time(slot.start) for slot in matches[:2]]
+                        if formatted_times:
+                            calendar_prompt = f"We’ll already be in your area ({user_zip}) at {', '.join(formatted_times)}. Would one of those work for a free estimate?"
+                        else:
+                            calendar_prompt = f"We’re not currently scheduled in {user_zip}, but I can open up time for you. What day & time works best?"
+                        messages.append({"role": "assistant", "content": calendar_prompt})
+
+                # --- GPT-4o streaming call, spoken phrase by phrase as it arrives
+                ai_functions = get_ai_functions()
+                trace.mark("llm_request_sent")
+                response = await get_openai_client().chat.completions.create(
+                    model="gpt-4o",
+                    messages=messages,
+                    functions=ai_functions,
+                    function_call="auto",
+                    stream=True
+                )
+                tts = TTSPipeline(audio_out.send_ulaw, gate=gate, prefetch=SPECULATION_TTS_PHRASES,
+                                  on_first_byte=lambda: trace.mark("tts_first_byte"))
+                audio_out.on_next_frame = lambda: trace.mark("first_media_sent")
+                reply_text = ""
+                function_called = None
+                fn_args_json = ""
+                try:
+                    async for chunk in response:
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta
+                        trace.mark("llm_first_token")
+                        if delta.content:
+                            reply_text += delta.content
+                            tts.feed(delta.content)
+                        if delta.function_call:
+                            if delta.function_call.name:
+                                function_called = delta.function_call.name
+                            if delta.function_call.arguments:
+                                fn_args_json += delta.function_call.arguments
+
+                    await gate.wait()
+                    transcript = gate.transcript
+                    print(f"[WS] Transcript: {transcript}")
+
+                    # Function-calling logic
+                    if function_called == "book_estimate":
+                        fn_args = json.loads(fn_args_json or "{}")
+                        session.set_slot("zip", fn_args["zip_code"])
+                        session.set_slot("address", fn_args["address"])
+                        session.set_slot("time", fn_args["date_time"])
+                        session.set_slot("notified", "1")
+                        # Owner SMS goes out from the outbox workers; only the job is written here
+                        session.queue(OUTBOX_JOBS_KEY, make_job("sms_owner", sid, {
+                            "date_time": fn_args["date_time"],
+                            "address": fn_args["address"],
+                            "phone": caller_number,
+                        }))
+                        reply_text = (
+                            f"You're all set! We have you down for a free estimate at {fn_args['address']} on {fn_args['date_time']}. "
+                            "We'll send you a confirmation shortly. Thank you!"
+                        )
+                        # Fixed wording comes from the TTS cache, only the slots are synthesized
+                        tts.say_parts([
+                            ("You're all set! We have you down for a free estimate at", True),
+                            (f"{fn_args['address']} on {fn_args['date_time']}.", False),
+                            ("We'll send you a confirmation shortly. Thank you!", True),
+                        ])
+
+                    # Save assistant message and the turn's slots while the reply plays;
+                    # a barge-in must not abort the write half way
+                    session.append("assistant", reply_text)
+                    started = time.perf_counter()
+                    await asyncio.shield(session.commit())
+                    trace.stage("redis_commit", time.perf_counter() - started)
+                    summarizer.maybe_start()
+
+                    await tts.finish()
+                    if function_called == "book_estimate":
+                        # Play closing prompt from the pre-encoded frame cache
+                        await audio_out.play_prompt("closing")
+                    else:
+                        await audio_out.flush()
+                    trace.finish()
+                except BaseException:
+                    await tts.cancel()
+                    await response.close()
+                    raise
+            except asyncio.CancelledError:
+                trace.finish("cancelled")
+                raise
+            except Exception as e:
+                trace.finish("error")
+                print("[WS] Error in turn:", e)
+
+        def record_caller(transcript):
+            # Final transcript: the caller's words and the slots in them are kept even
+            # if the reply is cut off (written to Redis with the turn, or by save_recorded)
+            session.append("user", transcript)
+            zip_found = re.search(r'\b77\d{3}\b', transcript)
+            if zip_found:
+                session.set_slot("zip", zip_found.group(0))
+            if caller_number:
+                session.set_slot("phone", caller_number)
+
+        async def save_recorded():
+            # Writes what a cancelled turn never committed
+            if session.pending:
+                try:
+                    await asyncio.shield(session.commit())
+                except Exception as e:
+                    print(f"[WS] Failed to save the caller's words: {e}")
+
+        async def interrupt():
+            # Caller started talking: drop the reply in flight and flush what Twilio has buffered
+            nonlocal current_turn
+            if current_turn and not current_turn.done():
+                current_turn.cancel()
+                await asyncio.gather(current_turn, return_exceptions=True)
+                await audio_out.clear()
+                print(f"[WS] Barge-in, cancelled reply in flight. SID={sid}")
+                await save_recorded()
+            current_turn = None
+
+        async def receive_from_assemblyai():
+            nonlocal current_turn
+            speculation = None
+            stabilizer = PartialStabilizer()
+            try:
+                async for msg in aai_ws:
+                    try:
+                        data = json.loads(msg)
+                        message_type = data.get("message_type")
+                        text = (data.get("text") or "").strip()
+                        if message_type == "PartialTranscript":
+                            if len(text.split()) >= BARGE_IN_MIN_WORDS:
+                                await interrupt()
+                            if SPECULATIVE_MODE and text:
+                                if speculation and normalize(text) != speculation.text:
+                                    # Caller kept talking: the speculative reply is stale
+                                    await speculation.discard()
+                                    speculation = None
+                                stable = stabilizer.observe(text)
+                                if stable and not speculation:
+                                    gate = TurnGate(text)
+                                    trace = call_trace.new_turn()
+                                    speculation = Speculation(stable, asyncio.create_task(run_turn(gate, trace)), gate, trace)
+                        elif message_type == "FinalTranscript" and text:
+                            await interrupt()
+                            stabilizer.reset()
+                            if speculation and normalize(text) == speculation.text:
+                                record_caller(text)
+                                speculation.commit(text)
+                                current_turn = speculation.task
+                            else:
+                                if speculation:
+                                    await speculation.discard()
+                                record_caller(text)
+                                trace = call_trace.new_turn()
+                                trace.mark("asr_final")
+                                current_turn = asyncio.create_task(run_turn(TurnGate(text, committed=True), trace))
+                            speculation = None
+                    except Exception as e:
+                        print("[WS] Error in AssemblyAI recv:", e)
+            except websockets.ConnectionClosed as e:
+                print(f"[WS] AssemblyAI session closed: {e}. SID={sid}")
+            finally:
+                if speculation:
+                    await speculation.discard()
+                if current_turn:
+                    current_turn.cancel()
+                    await asyncio.gather(current_turn, return_exceptions=True)
+                await save_recorded()
+                if SPECULATIVE_MODE:
+                    print(f"[WS] Speculation stats: {speculation_stats.summary()}")
+                await summarizer.close()
+                call_trace.close()
+
+        receiver = asyncio.create_task(receive_from_assemblyai())
+        try:
+            # The call lasts as long as Twilio's stream; AssemblyAI is shut down after it
+            await send_to_assemblyai()
+        finally:
+            await end_asr()
+            receiver.cancel()
+            await asyncio.gather(receiver, return_exceptions=True)
+    finally:
+        await aai_ws.close()
+
+# --- STARTUP WARMUP (BEFORE ANY PORT ACCEPTS TRAFFIC)
+async def warmup():
+    """
+    Pays the first call's one-off costs up front: SDK imports, Google
+    credentials and the Calendar client, fixed prompts and canned replies,
+    the ZIP table, Redis connections and the upstream pools. Independent
+    steps run concurrently; a step that fails is logged and left to happen
+    lazily on the call path. After WARMUP_TIMEOUT_S startup goes ahead and
+    unfinished steps keep running in the background. Returns per-step
+    milliseconds.
+    """
+    loop = asyncio.get_running_loop()
+    timings = {}
+
+    async def step(name, fn):
+        started = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(fn):
+                await fn()
+            else:
+                await loop.run_in_executor(None, fn)
+        except Exception as e:
+            print(f"[WARMUP] {name} failed: {e}")
+        timings[name] = round((time.perf_counter() - started) * 1000, 1)
+
+    async def redis_pool():
+        await get_async_redis().ping()
+
+    async def upstream_pools():
+        start_upstreams()
+        await upstreams.warm()
+
+    started = time.perf_counter()
+    steps = asyncio.gather(
+        step("openai", get_openai_client),
+        step("calendar", calendar_availability.get_service),
+        step("prompts", prompt_cache.warm),
+        step("intents", intents.warm),
+        step("zip_index", get_zip_index),
+        step("redis", redis_pool),
+        step("upstreams", upstream_pools),
+    )
+    try:
+        # shield: a step still running at the deadline finishes on its own
+        await asyncio.wait_for(asyncio.shield(steps), WARMUP_TIMEOUT_S)
+    except asyncio.TimeoutError:
+        late = [name for name in ("openai", "calendar", "prompts", "intents",
+                                  "zip_index", "redis", "upstreams") if name not in timings]
+        print(f"[WARMUP] Still running after {WARMUP_TIMEOUT_S:.0f} s, "
+              f"left to finish in the background: {', '.join(late)}")
+    timings["total"] = round((time.perf_counter() - started) * 1000, 1)
+    print("[WARMUP] " + ", ".join(f"{name} {ms:.0f} ms" for name, ms in timings.items()))
+    return timings
+
+# --- RUN BOTH FLASK (FOR HOOKS) AND WS (FOR MEDIA STREAM) ON RENDER
+def run_flask():
+    port = int(os.environ.get("PORT", 5000))
+    app.run(host="0.0.0.0", port=port)
+
+def run_ws(on_ready=None):
+    ws_port = 8765
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    async def start():
+        # Everything is warm before the media port accepts a call. The outbox
+        # worker and upstream pools create tasks, so they start here, inside the loop
+        await warmup()
+        calendar_availability.start()
+        await websockets.serve(process_media_stream, "0.0.0.0", ws_port)
+        outbox_worker.start()
+
+    loop.run_until_complete(start())
+    if on_ready:
+        on_ready()
+    loop.run_forever()
+
+if __name__ == "__main__":
+    import threading
+    # The webhook port opens only once warmup is done
+    run_ws(on_ready=lambda: threading.Thread(target=run_flask).start())
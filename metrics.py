@@ -0,0 +1,370 @@
+import os
+import json
+import time
+import bisect
+import socket
+import threading
+from collections import OrderedDict
+
+# --- ENV VARS
+TRACE_DUMP_DIR = os.environ.get("TRACE_DUMP_DIR")
+RECENT_CALL_TRACES = int(os.environ.get("RECENT_CALL_TRACES", 200))
+# With a Redis URL, every worker's numbers and call traces are shared (see MetricsRegistry.share)
+METRICS_REDIS_URL = os.environ.get("METRICS_REDIS_URL", os.environ.get("REDIS_URL"))
+METRICS_FLUSH_S = float(os.environ.get("METRICS_FLUSH_S", 5))
+CALL_TRACE_TTL_S = int(os.environ.get("CALL_TRACE_TTL_S", 86400))
+
+TOTALS_KEY = "metrics:totals"
+WORKERS_KEY = "metrics:workers"
+# A worker whose gauges were not refreshed for this long is gone
+WORKER_TTL_S = METRICS_FLUSH_S * 3
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0)
+
+# Points in a turn, in order; each is observed as seconds after asr_final
+TURN_MILESTONES = (
+    "asr_final",
+    "llm_request_sent",
+    "llm_first_token",
+    "tts_first_byte",
+    "first_media_sent",
+    "turn_completed",
+)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    Process-wide histograms and counters, rendered in Prometheus text format.
+
+    Under gunicorn each worker has its own registry. After share(), a
+    background thread adds each worker's new counts to totals in Redis every
+    METRICS_FLUSH_S, so /metrics on any worker reports the whole service (and
+    totals survive worker restarts). Collector gauges describe one process;
+    they are reported per worker, with a worker label.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.help = {}
+        self.histograms = {}
+        self.counters = {}
+        self.collectors = []
+        # (name, labels, part) -> amount not yet added to the Redis totals; None until shared
+        self.pending = None
+        self.traces = []
+        self.redis = None
+        self.worker = None
+        self.wake = threading.Event()
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = Histogram()
+            hist.observe(value)
+            if self.pending is not None:
+                self._pend(name, key, bisect.bisect_left(hist.buckets, value), 1)
+                self._pend(name, key, "sum", value)
+                self._pend(name, key, "count", 1)
+
+    def inc(self, name, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+            if self.pending is not None:
+                self._pend(name, key, "value", amount)
+
+    def _pend(self, name, key, part, amount):
+        field = (name, key, part)
+        self.pending[field] = self.pending.get(field, 0) + amount
+
+    def add_collector(self, collect):
+        # collect() -> iterable of (name, type, labels dict, value), read at scrape time
+        self.collectors.append(collect)
+
+    def share(self, redis_url=METRICS_REDIS_URL):
+        """Starts adding this worker's numbers to the shared totals. Call once per worker, after the fork."""
+        if not redis_url or self.redis is not None:
+            return self
+        import redis
+        self.redis = redis.from_url(redis_url)
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        with self.lock:
+            # Whatever was recorded during startup counts too
+            self.pending = {}
+            for name, series in self.histograms.items():
+                for key, hist in series.items():
+                    for i, count in enumerate(hist.counts):
+                        if count:
+                            self._pend(name, key, i, count)
+                    self._pend(name, key, "sum", hist.sum)
+                    self._pend(name, key, "count", hist.count)
+            for name, series in self.counters.items():
+                for key, value in series.items():
+                    self._pend(name, key, "value", value)
+        threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True).start()
+        return self
+
+    def save_trace(self, call_sid, data):
+        if self.redis is not None:
+            with self.lock:
+                self.traces.append((call_sid, data))
+            self.wake.set()
+
+    def load_trace(self, call_sid):
+        if self.redis is None:
+            return None
+        import redis
+        try:
+            data = self.redis.get(f"metrics:trace:{call_sid}")
+        except redis.RedisError as e:
+            print(f"[METRICS] Failed to read trace for {call_sid}: {e}")
+            return None
+        return json.loads(data) if data else None
+
+    def _flush_loop(self):
+        while True:
+            self.wake.wait(METRICS_FLUSH_S)
+            self.wake.clear()
+            self.flush()
+
+    def flush(self):
+        """Adds this worker's new counts to the Redis totals and refreshes its gauges."""
+        if self.redis is None:
+            return
+        import redis
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            traces, self.traces = self.traces, []
+        try:
+            gauges = {json.dumps([name, kind, sorted(labels.items())]): value
+                      for name, kind, labels, value in self._collect()}
+            now = time.time()
+            pipe = self.redis.pipeline(transaction=False)
+            for (name, key, part), amount in pending.items():
+                pipe.hincrbyfloat(TOTALS_KEY, json.dumps([name, key, part]), amount)
+            gauges_key = f"metrics:gauges:{self.worker}"
+            pipe.delete(gauges_key)
+            if gauges:
+                pipe.hset(gauges_key, mapping=gauges)
+                pipe.expire(gauges_key, int(WORKER_TTL_S) + 1)
+            pipe.zadd(WORKERS_KEY, {self.worker: now})
+            pipe.zremrangebyscore(WORKERS_KEY, 0, now - WORKER_TTL_S)
+            for call_sid, data in traces:
+                pipe.set(f"metrics:trace:{call_sid}", json.dumps(data), ex=CALL_TRACE_TTL_S)
+            pipe.execute()
+        except (redis.RedisError, OSError) as e:
+            print(f"[METRICS] Flush to Redis failed, will retry: {e}")
+            # Keep the deltas: they are added on the next flush
+            with self.lock:
+                for (name, key, part), amount in pending.items():
+                    self._pend(name, key, part, amount)
+                self.traces[:0] = traces
+
+    def _collect(self):
+        for collect in self.collectors:
+            yield from collect()
+
+    def render(self):
+        if self.redis is not None:
+            import redis
+            try:
+                return self._render_shared()
+            except redis.RedisError as e:
+                print(f"[METRICS] Redis unavailable, serving this worker's metrics only: {e}")
+        with self.lock:
+            histograms = {name: {key: (h.counts, h.sum, h.count) for key, h in series.items()}
+                          for name, series in self.histograms.items()}
+            counters = {name: dict(series) for name, series in self.counters.items()}
+        gauges = [(name, kind, tuple(sorted(labels.items())), value) for name, kind, labels, value in self._collect()]
+        return self._format(histograms, counters, gauges)
+
+    def _render_shared(self):
+        self.flush()
+        histograms, counters = {}, {}
+        for field, value in self.redis.hgetall(TOTALS_KEY).items():
+            name, key, part = json.loads(field)
+            key = tuple(tuple(pair) for pair in key)
+            value = float(value)
+            if part == "value":
+                counters.setdefault(name, {})[key] = value
+                continue
+            counts, total, count = histograms.setdefault(name, {}).get(key, ([0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0))
+            if part == "sum":
+                total = value
+            elif part == "count":
+                count = value
+            else:
+                counts[part] = value
+            histograms[name][key] = (counts, total, count)
+        gauges = []
+        workers = self.redis.zrangebyscore(WORKERS_KEY, time.time() - WORKER_TTL_S, "+inf")
+        pipe = self.redis.pipeline(transaction=False)
+        for worker in workers:
+            pipe.hgetall(f"metrics:gauges:{worker.decode()}")
+        for worker, values in zip(workers, pipe.execute()):
+            for field, value in values.items():
+                name, kind, labels = json.loads(field)
+                key = tuple(sorted([tuple(pair) for pair in labels] + [("worker", worker.decode())]))
+                gauges.append((name, kind, key, float(value)))
+        gauges.sort(key=lambda g: (g[0], g[2]))
+        return self._format(histograms, counters, gauges)
+
+    def _format(self, histograms, counters, gauges):
+        lines = []
+        for name, series in sorted(histograms.items()):
+            self._header(lines, name, "histogram")
+            for key, (counts, total, count) in sorted(series.items()):
+                cumulative = 0
+                for bound, n in zip(LATENCY_BUCKETS, counts):
+                    cumulative += n
+                    lines.append(f"{name}_bucket{_labels(key + (('le', str(bound)),))} {_number(cumulative)}")
+                lines.append(f"{name}_bucket{_labels(key + (('le', '+Inf'),))} {_number(count)}")
+                lines.append(f"{name}_sum{_labels(key)} {total:.6f}")
+                lines.append(f"{name}_count{_labels(key)} {_number(count)}")
+        for name, series in sorted(counters.items()):
+            self._header(lines, name, "counter")
+            for key, value in sorted(series.items()):
+                lines.append(f"{name}{_labels(key)} {_number(value)}")
+        seen = set()
+        for name, kind, key, value in gauges:
+            if name not in seen:
+                self._header(lines, name, kind)
+                seen.add(name)
+            lines.append(f"{name}{_labels(key)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    def _header(self, lines, name, kind):
+        if name in self.help:
+            lines.append(f"# HELP {name} {self.help[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+
+def _labels(key):
+    if not key:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in key) + "}"
+
+
+def _number(value):
+    # Totals come back from Redis as floats; whole numbers print without ".0"
+    return str(int(value)) if float(value).is_integer() else str(value)
+
+
+registry = MetricsRegistry()
+registry.describe("voice_turn_milestone_seconds", "Seconds from the ASR final transcript to each point in a turn")
+registry.describe("voice_stage_seconds", "Duration of individual stages (Redis, calendar lookup)")
+registry.describe("voice_turns_total", "Turns by outcome")
+
+recent_traces = OrderedDict()
+recent_lock = threading.Lock()
+
+
+class TurnTrace:
+    def __init__(self, call_sid, index):
+        self.call_sid = call_sid
+        self.index = index
+        self.marks = {}
+        self.stages = {}
+        self.outcome = None
+
+    def mark(self, name):
+        if name not in self.marks:
+            self.marks[name] = time.perf_counter()
+
+    def stage(self, name, seconds):
+        self.stages[name] = seconds
+        registry.observe("voice_stage_seconds", seconds, stage=name)
+
+    def finish(self, outcome="completed"):
+        if self.outcome:
+            return
+        self.outcome = outcome
+        registry.inc("voice_turns_total", outcome=outcome)
+        if outcome != "completed" or "asr_final" not in self.marks:
+            return
+        self.mark("turn_completed")
+        t0 = self.marks["asr_final"]
+        for name in TURN_MILESTONES:
+            if name in self.marks:
+                # Work done speculatively before the final transcript counts as zero
+                registry.observe("voice_turn_milestone_seconds", max(0.0, self.marks[name] - t0), milestone=name)
+
+    def to_dict(self):
+        t0 = self.marks.get("asr_final") or min(self.marks.values(), default=0.0)
+        return {
+            "turn": self.index,
+            "outcome": self.outcome,
+            "milestones_ms": {name: round((t - t0) * 1000, 1) for name, t in self.marks.items()},
+            "stages_ms": {name: round(s * 1000, 1) for name, s in self.stages.items()},
+        }
+
+
+class CallTrace:
+    def __init__(self, call_sid):
+        self.call_sid = call_sid
+        self.started_at = time.time()
+        self.stages = {}
+        self.counters = {}
+        self.turns = []
+
+    def stage(self, name, seconds):
+        self.stages[name] = seconds
+        registry.observe("voice_stage_seconds", seconds, stage=name)
+
+    def new_turn(self):
+        trace = TurnTrace(self.call_sid, len(self.turns))
+        self.turns.append(trace)
+        return trace
+
+    def to_dict(self):
+        return {
+            "call_sid": self.call_sid,
+            "started_at": self.started_at,
+            "stages_ms": {name: round(s * 1000, 1) for name, s in self.stages.items()},
+            "counters": self.counters,
+            "turns": [t.to_dict() for t in self.turns if t.outcome],
+        }
+
+    def close(self):
+        for turn in self.turns:
+            turn.finish("abandoned")
+        data = self.to_dict()
+        with recent_lock:
+            recent_traces[self.call_sid] = data
+            while len(recent_traces) > RECENT_CALL_TRACES:
+                recent_traces.popitem(last=False)
+        registry.save_trace(self.call_sid, data)
+        if TRACE_DUMP_DIR:
+            try:
+                os.makedirs(TRACE_DUMP_DIR, exist_ok=True)
+                with open(os.path.join(TRACE_DUMP_DIR, f"{self.call_sid}.json"), "w") as f:
+                    json.dump(data, f, indent=2)
+            except OSError as e:
+                print(f"[METRICS] Failed to dump trace for {self.call_sid}: {e}")
+
+
+def get_call_trace(call_sid):
+    # The call may have been served by another worker
+    with recent_lock:
+        trace = recent_traces.get(call_sid)
+    return trace or registry.load_trace(call_sid)
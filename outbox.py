@@ -0,0 +1,240 @@
+"""
+Durable outbox for side effects of a call (owner SMS today; calendar writes
+or CRM pushes later). The call path only appends a job to a Redis list, in
+the same round trip as the turn's session writes; background workers
+deliver it with pooled clients, retry failures with backoff, and skip jobs
+already delivered, so the speech path never waits on a notification.
+
+Each job has an id of the form <kind>:<call sid>, which makes delivery
+idempotent per call even if the job is queued twice or redelivered after a
+worker dies.
+
+    python outbox.py        # standalone worker; the web workers also run one each
+
+Redis keys:
+    outbox:jobs             LIST  job JSON waiting for delivery
+    outbox:processing       LIST  jobs claimed by a worker
+    outbox:claims           HASH  job id -> epoch seconds claimed
+    outbox:retry            ZSET  job JSON -> epoch seconds due
+    outbox:dead             LIST  jobs that exhausted their attempts
+    outbox:done:<job id>    delivered marker
+"""
+import os
+import json
+import time
+import random
+import asyncio
+from session_store import get_async_redis
+from metrics import registry
+
+# --- ENV VARS
+TWILIO_FROM_NUMBER = os.environ.get("TWILIO_FROM_NUMBER")
+OWNER_PHONE_NUMBER = os.environ.get("OWNER_PHONE_NUMBER")
+OUTBOX_BATCH = int(os.environ.get("OUTBOX_BATCH", 10))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 6))
+OUTBOX_RETRY_BASE_S = float(os.environ.get("OUTBOX_RETRY_BASE_S", 5))
+# A claimed job not acknowledged within this long is handed to another worker
+OUTBOX_VISIBILITY_S = int(os.environ.get("OUTBOX_VISIBILITY_S", 120))
+OUTBOX_DONE_TTL = 7 * 24 * 3600
+
+JOBS_KEY = "outbox:jobs"
+PROCESSING_KEY = "outbox:processing"
+CLAIMS_KEY = "outbox:claims"
+RETRY_KEY = "outbox:retry"
+DEAD_KEY = "outbox:dead"
+DONE_PREFIX = "outbox:done:"
+
+HANDLERS = {}
+
+registry.describe("voice_outbox_jobs_total", "Outbox job deliveries by kind and result")
+registry.describe("voice_outbox_delay_seconds", "Seconds from a job being queued to its delivery")
+
+
+def handler(kind):
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+def make_job(kind, call_sid, payload):
+    # Returned as JSON for CallSession.queue, which writes it with the turn's commit
+    return json.dumps({"id": f"{kind}:{call_sid}", "kind": kind, "payload": payload,
+                       "queued_at": time.time(), "attempts": 0})
+
+
+_twilio_client = None
+
+
+def get_twilio_client():
+    # One pooled async client per process, created on the worker's loop
+    global _twilio_client
+    if _twilio_client is None:
+        from dialer import make_twilio_client
+        _twilio_client = make_twilio_client()
+    return _twilio_client
+
+
+@handler("sms_owner")
+async def send_owner_sms(payload):
+    if not (TWILIO_FROM_NUMBER and OWNER_PHONE_NUMBER):
+        raise RuntimeError("Twilio SMS notification vars not all set")
+    message = (
+        f"🗓️ New Air Duct Estimate Booking!\n"
+        f"Address: {payload.get('address')}\n"
+        f"Date/Time: {payload.get('date_time')}\n"
+        f"Phone: {payload.get('phone')}\n"
+    )
+    if payload.get("notes"):
+        message += f"Notes: {payload['notes']}"
+    await get_twilio_client().messages.create_async(to=OWNER_PHONE_NUMBER, from_=TWILIO_FROM_NUMBER, body=message)
+
+
+class OutboxWorker:
+    def __init__(self, redis_client=None, batch=OUTBOX_BATCH, poll_s=0.5):
+        self.redis = redis_client
+        self.batch = batch
+        self.poll_s = poll_s
+        self.task = None
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.redis = self.redis or get_async_redis()
+            self.task = asyncio.create_task(self.run())
+        return self
+
+    async def stop(self):
+        if self.task and not self.task.done():
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+
+    async def run(self):
+        last_sweep = 0.0
+        while True:
+            try:
+                if time.monotonic() - last_sweep >= self.poll_s:
+                    last_sweep = time.monotonic()
+                    await self.sweep()
+                claimed = await self.claim()
+                if claimed:
+                    await self.deliver(claimed)
+                else:
+                    await asyncio.sleep(self.poll_s)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[OUTBOX] Worker error: {e}")
+                await asyncio.sleep(self.poll_s)
+
+    async def claim(self):
+        # Polled rather than BLMOVE, which would pin a connection of the shared pool per worker
+        claimed = []
+        while len(claimed) < self.batch:
+            raw = await self.redis.lmove(JOBS_KEY, PROCESSING_KEY, "RIGHT", "LEFT")
+            if raw is None:
+                break
+            claimed.append(raw)
+        if not claimed:
+            return claimed
+        now = time.time()
+        # If the worker dies before this, sweep() times the jobs out from when it first sees them
+        await self.redis.hset(CLAIMS_KEY, mapping={json.loads(raw)["id"]: now for raw in claimed})
+        return claimed
+
+    async def deliver(self, claimed):
+        jobs = [json.loads(raw) for raw in claimed]
+        pipe = self.redis.pipeline(transaction=False)
+        for job in jobs:
+            pipe.exists(DONE_PREFIX + job["id"])
+        done = await pipe.execute()
+        seen = set()
+        for i, job in enumerate(jobs):
+            # The same job queued twice in one batch is delivered once
+            done[i] = done[i] or job["id"] in seen
+            seen.add(job["id"])
+        results = await asyncio.gather(*[self._run_job(job, already) for job, already in zip(jobs, done)],
+                                       return_exceptions=True)
+        # Acknowledge the whole batch in one round trip
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        for raw, job, result in zip(claimed, jobs, results):
+            pipe.lrem(PROCESSING_KEY, 1, raw)
+            pipe.hdel(CLAIMS_KEY, job["id"])
+            if result is None or result == "duplicate":
+                continue
+            job["attempts"] += 1
+            job["error"] = str(result)[:200]
+            if job["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+                pipe.lpush(DEAD_KEY, json.dumps(job))
+                registry.inc("voice_outbox_jobs_total", kind=job["kind"], result="dead")
+                print(f"[OUTBOX] Giving up on {job['id']} after {job['attempts']} attempts: {result}")
+            else:
+                delay = OUTBOX_RETRY_BASE_S * 2 ** (job["attempts"] - 1) * random.uniform(0.8, 1.2)
+                pipe.zadd(RETRY_KEY, {json.dumps(job): now + delay})
+                registry.inc("voice_outbox_jobs_total", kind=job["kind"], result="retry")
+                print(f"[OUTBOX] {job['id']} failed ({result}); retrying in {delay:.0f}s")
+        await pipe.execute()
+
+    async def _run_job(self, job, already_done):
+        if already_done:
+            registry.inc("voice_outbox_jobs_total", kind=job["kind"], result="duplicate")
+            return "duplicate"
+        fn = HANDLERS.get(job["kind"])
+        if fn is None:
+            raise RuntimeError(f"no handler for job kind {job['kind']!r}")
+        await fn(job["payload"])
+        # Marked before the batch is acknowledged, so a redelivery after a crash is skipped
+        await self.redis.set(DONE_PREFIX + job["id"], time.time(), ex=OUTBOX_DONE_TTL)
+        registry.inc("voice_outbox_jobs_total", kind=job["kind"], result="delivered")
+        registry.observe("voice_outbox_delay_seconds", max(0.0, time.time() - job["queued_at"]))
+        print(f"[OUTBOX] Delivered {job['id']}")
+        return None
+
+    async def sweep(self):
+        now = time.time()
+        # Retries that have come due go back on the main queue
+        for raw in await self.redis.zrangebyscore(RETRY_KEY, "-inf", now, start=0, num=100):
+            if await self.redis.zrem(RETRY_KEY, raw):
+                await self.redis.lpush(JOBS_KEY, raw)
+        # Jobs claimed by a worker that died (or hung) are delivered by someone else
+        claims = {k.decode(): float(v) for k, v in (await self.redis.hgetall(CLAIMS_KEY)).items()}
+        processing = await self.redis.lrange(PROCESSING_KEY, 0, -1)
+        # A worker that died between its LMOVE and recording the claim left a
+        # job with no timestamp; start its clock now (HSETNX keeps a claim
+        # recorded in the meantime)
+        unclaimed = {json.loads(raw)["id"] for raw in processing} - claims.keys()
+        if unclaimed:
+            pipe = self.redis.pipeline(transaction=False)
+            for job_id in unclaimed:
+                pipe.hsetnx(CLAIMS_KEY, job_id, now)
+            await pipe.execute()
+        stale = {job_id for job_id, claimed_at in claims.items() if now - claimed_at > OUTBOX_VISIBILITY_S}
+        if not stale:
+            return
+        listed = set()
+        for raw in processing:
+            job_id = json.loads(raw)["id"]
+            listed.add(job_id)
+            if job_id in stale and await self.redis.lrem(PROCESSING_KEY, 1, raw):
+                await self.redis.hdel(CLAIMS_KEY, job_id)
+                await self.redis.lpush(JOBS_KEY, raw)
+                print(f"[OUTBOX] Requeued {job_id} from an unresponsive worker")
+        # Claims left behind by jobs acknowledged while this sweep looked
+        if stale - listed:
+            await self.redis.hdel(CLAIMS_KEY, *(stale - listed))
+
+outbox_worker = OutboxWorker()
+
+
+async def main():
+    worker = OutboxWorker().start()
+    try:
+        await worker.task
+    finally:
+        if _twilio_client is not None:
+            await _twilio_client.http_client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
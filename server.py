@@ -0,0 +1,152 @@
+"""
+Production entry point: the Twilio webhooks (Flask) and the /ws media
+stream served by one aiohttp application on one port, run by gunicorn
+across worker processes (see gunicorn.conf.py):
+
+    gunicorn -c gunicorn.conf.py server:create_app
+
+Each worker has its own event loop and GIL; per-call state lives in Redis
+(session_store), so any worker can take any call.
+"""
+import io
+import os
+import sys
+import asyncio
+import aiohttp
+from aiohttp import web
+
+import main
+from metrics import registry
+from outbox import outbox_worker
+from upstreams import upstreams
+from calendar_service import calendar_availability
+
+# --- ENV VARS
+# How long a restarting worker waits for in-progress calls to hang up
+DRAIN_TIMEOUT = int(os.environ.get("DRAIN_TIMEOUT", 120))
+
+
+class MediaSocket:
+    """Gives an aiohttp WebSocketResponse the websockets interface process_media_stream uses."""
+
+    def __init__(self, ws, path):
+        self.ws = ws
+        self.path = path
+
+    async def send(self, data):
+        if isinstance(data, str):
+            await self.ws.send_str(data)
+        else:
+            await self.ws.send_bytes(data)
+
+    def __aiter__(self):
+        return self._messages()
+
+    async def _messages(self):
+        async for msg in self.ws:
+            if msg.type in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
+                yield msg.data
+            elif msg.type == aiohttp.WSMsgType.ERROR:
+                break
+
+
+async def media_stream(request):
+    ws = web.WebSocketResponse(max_msg_size=0)
+    await ws.prepare(request)
+    calls = request.app["active_calls"]
+    task = asyncio.current_task()
+    calls.add(task)
+    try:
+        await main.process_media_stream(MediaSocket(ws, request.path_qs), request.path)
+    finally:
+        calls.discard(task)
+        await ws.close()
+    return ws
+
+
+async def flask_bridge(request):
+    # Minimal WSGI bridge so the existing Flask routes are served on this port
+    body = await request.read()
+    environ = {
+        "REQUEST_METHOD": request.method,
+        "SCRIPT_NAME": "",
+        "PATH_INFO": request.path,
+        "QUERY_STRING": request.query_string,
+        "CONTENT_TYPE": request.headers.get("Content-Type", ""),
+        "CONTENT_LENGTH": str(len(body)),
+        "SERVER_NAME": request.url.host or "localhost",
+        "SERVER_PORT": str(request.url.port or 80),
+        "SERVER_PROTOCOL": f"HTTP/{request.version.major}.{request.version.minor}",
+        "REMOTE_ADDR": request.remote or "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": request.headers.get("X-Forwarded-Proto", request.scheme),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in request.headers.items():
+        key = "HTTP_" + name.upper().replace("-", "_")
+        if key not in ("HTTP_CONTENT_TYPE", "HTTP_CONTENT_LENGTH"):
+            environ[key] = value
+
+    def call_flask():
+        status_headers = {}
+
+        def start_response(status, headers, exc_info=None):
+            status_headers["status"] = int(status.split(" ", 1)[0])
+            status_headers["headers"] = headers
+
+        result = main.app.wsgi_app(environ, start_response)
+        try:
+            payload = b"".join(result)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        return status_headers["status"], status_headers["headers"], payload
+
+    status, headers, payload = await asyncio.get_running_loop().run_in_executor(None, call_flask)
+    response = web.Response(status=status, body=payload)
+    for name, value in headers:
+        if name.lower() not in ("content-length", "transfer-encoding", "connection"):
+            response.headers.add(name, value)
+    return response
+
+
+async def on_startup(app):
+    # Runs in each worker before it accepts connections
+    await main.warmup()
+    calendar_availability.start()
+    # Each worker also delivers queued side effects (owner SMS)
+    outbox_worker.start()
+    # /metrics on any worker reports the totals of all of them
+    registry.share()
+    print(f"[SERVER] Worker {os.getpid()} ready")
+
+
+async def on_shutdown(app):
+    # Graceful drain: the listener is already closed, let live calls finish
+    calls = app["active_calls"]
+    if calls:
+        print(f"[SERVER] Worker {os.getpid()} draining {len(calls)} call(s)")
+        await asyncio.wait(list(calls), timeout=DRAIN_TIMEOUT)
+    await outbox_worker.stop()
+    await upstreams.stop()
+    calendar_availability.stop()
+    await asyncio.get_running_loop().run_in_executor(None, registry.flush)
+
+
+async def create_app():
+    app = web.Application()
+    app["active_calls"] = set()
+    app.router.add_get("/ws", media_stream)
+    app.router.add_route("*", "/{tail:.*}", flask_bridge)
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    return app
+
+
+if __name__ == "__main__":
+    # Single process, for local runs without gunicorn
+    web.run_app(create_app(), port=int(os.environ.get("PORT", 5000)))
@@ -0,0 +1,101 @@
+import os
+import json
+import redis.asyncio as aioredis
+
+REDIS_URL = os.environ.get("REDIS_URL")
+
+# Safety cap only: older turns are folded into the running summary (context_window)
+HISTORY_LIMIT = 40
+HISTORY_TTL = 3600
+SLOT_TTL = 900
+NOTIFIED_TTL = 1800
+SLOTS = ("zip", "phone", "address", "time", "notified")
+
+_async_redis = None
+
+
+def get_async_redis():
+    global _async_redis
+    if _async_redis is None:
+        _async_redis = aioredis.from_url(REDIS_URL)
+    return _async_redis
+
+
+class CallSession:
+    """
+    Conversation state for one call. Redis is read once when the stream
+    opens; after that the in-process copy is authoritative and each turn's
+    writes go out together in a single pipelined round trip.
+    """
+
+    def __init__(self, sid, client=None):
+        self.sid = sid
+        self.redis = client or get_async_redis()
+        self.history = []
+        self.slots = {}
+        self.summary = ""
+        self.pending = []
+        self.queued = []
+
+    def _key(self, name):
+        return f"{name}:{self.sid}"
+
+    async def load(self):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.lrange(self._key("turns"), 0, -1)
+        pipe.mget([self._key(name) for name in SLOTS] + [self._key("summary")])
+        turns, values = await pipe.execute()
+        self.history = [json.loads(t) for t in turns]
+        self.slots = {name: v.decode() for name, v in zip(SLOTS, values) if v is not None}
+        self.summary = values[-1].decode() if values[-1] is not None else ""
+        return self
+
+    def append(self, role, content):
+        message = {"role": role, "content": content}
+        self.history.append(message)
+        del self.history[:-HISTORY_LIMIT]
+        self.pending.append(message)
+
+    def set_slot(self, name, value):
+        self.slots[name] = value
+
+    def queue(self, list_key, value):
+        # Pushed onto a Redis list (e.g. the outbox) with the turn's other writes
+        self.queued.append((list_key, value))
+
+    async def commit(self):
+        # All of the turn's writes, one round trip
+        pending, self.pending = self.pending, []
+        queued, self.queued = self.queued, []
+        pipe = self.redis.pipeline(transaction=False)
+        if pending:
+            key = self._key("turns")
+            pipe.rpush(key, *[json.dumps(m) for m in pending])
+            pipe.ltrim(key, -HISTORY_LIMIT, -1)
+            pipe.expire(key, HISTORY_TTL)
+        for name, value in self.slots.items():
+            pipe.set(self._key(name), value, ex=NOTIFIED_TTL if name == "notified" else SLOT_TTL)
+        for list_key, value in queued:
+            pipe.lpush(list_key, value)
+        try:
+            await pipe.execute()
+        except BaseException:
+            self.pending[:0] = pending
+            self.queued[:0] = queued
+            raise
+
+    async def fold(self, count, summary):
+        # Replace the oldest `count` (already committed) messages with a summary
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.ltrim(self._key("turns"), count, -1)
+        pipe.set(self._key("summary"), summary, ex=HISTORY_TTL)
+        await pipe.execute()
+        del self.history[:count]
+        self.summary = summary
+
+    async def clear(self):
+        self.history = []
+        self.slots = {}
+        self.summary = ""
+        self.pending = []
+        await self.redis.delete(self._key("turns"), self._key("summary"), *[self._key(name) for name in SLOTS])
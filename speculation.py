@@ -0,0 +1,121 @@
+import os
+import re
+import time
+import asyncio
+from metrics import registry
+
+# --- ENV VARS
+SPECULATIVE_MODE = os.environ.get("SPECULATIVE_MODE", "0") == "1"
+# A partial counts as stable once it has this many words, has been repeated
+# unchanged this many times, and has not changed for this long
+SPECULATION_MIN_WORDS = int(os.environ.get("SPECULATION_MIN_WORDS", 3))
+SPECULATION_MIN_REPEATS = int(os.environ.get("SPECULATION_MIN_REPEATS", 2))
+SPECULATION_STABLE_MS = int(os.environ.get("SPECULATION_STABLE_MS", 250))
+# How many TTS phrases may be synthesized before the turn is confirmed
+SPECULATION_TTS_PHRASES = int(os.environ.get("SPECULATION_TTS_PHRASES", 1))
+
+_NON_WORD = re.compile(r"[^\w\s]")
+
+
+def normalize(text):
+    # Partials come back unpunctuated and lower-case, finals formatted
+    return " ".join(_NON_WORD.sub("", text.lower()).split())
+
+
+class TurnGate:
+    """Holds a turn's spoken output and side effects until its transcript is final."""
+
+    def __init__(self, transcript, committed=False):
+        self.transcript = transcript
+        self.event = asyncio.Event()
+        if committed:
+            self.event.set()
+
+    def commit(self, transcript):
+        self.transcript = transcript
+        self.event.set()
+
+    def is_set(self):
+        return self.event.is_set()
+
+    async def wait(self):
+        await self.event.wait()
+
+
+class PartialStabilizer:
+    def __init__(self):
+        self.text = ""
+        self.repeats = 0
+        self.since = 0.0
+
+    def observe(self, partial):
+        """Returns the normalized partial once it is stable enough to speculate on."""
+        text = normalize(partial)
+        now = time.monotonic()
+        if text != self.text:
+            self.text, self.repeats, self.since = text, 1, now
+        else:
+            self.repeats += 1
+        if (len(text.split()) >= SPECULATION_MIN_WORDS
+                and self.repeats >= SPECULATION_MIN_REPEATS
+                and (now - self.since) * 1000 >= SPECULATION_STABLE_MS):
+            return text
+        return None
+
+    def reset(self):
+        self.text, self.repeats, self.since = "", 0, 0.0
+
+
+class SpeculationStats:
+    def __init__(self):
+        self.started = 0
+        self.committed = 0
+        self.discarded = 0
+        self.lead_ms_total = 0.0
+
+    def hit_rate(self):
+        return self.committed / self.started if self.started else 0.0
+
+    def summary(self):
+        avg_lead = self.lead_ms_total / self.committed if self.committed else 0.0
+        return (f"started={self.started} committed={self.committed} discarded={self.discarded} "
+                f"hit_rate={self.hit_rate():.2f} avg_lead_ms={avg_lead:.0f}")
+
+
+# Process-wide counters, for tuning the thresholds above against token spend
+speculation_stats = SpeculationStats()
+
+
+def _collect_speculation():
+    for outcome in ("started", "committed", "discarded"):
+        yield "voice_speculation_total", "counter", {"outcome": outcome}, getattr(speculation_stats, outcome)
+    yield "voice_speculation_hit_ratio", "gauge", {}, round(speculation_stats.hit_rate(), 4)
+
+
+registry.describe("voice_speculation_total", "Speculative turns by outcome")
+registry.describe("voice_speculation_hit_ratio", "Share of speculative turns committed by the final transcript")
+registry.add_collector(_collect_speculation)
+
+
+class Speculation:
+    def __init__(self, text, task, gate, trace=None):
+        self.text = text
+        self.task = task
+        self.gate = gate
+        self.trace = trace
+        self.started_at = time.monotonic()
+        speculation_stats.started += 1
+
+    def commit(self, transcript):
+        speculation_stats.committed += 1
+        speculation_stats.lead_ms_total += (time.monotonic() - self.started_at) * 1000
+        if self.trace:
+            self.trace.mark("asr_final")
+        self.gate.commit(transcript)
+
+    async def discard(self):
+        speculation_stats.discarded += 1
+        if self.trace:
+            self.trace.finish("discarded")
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
@@ -0,0 +1,24 @@
+import pytest
+
+import intents
+
+
+@pytest.mark.parametrize("transcript", [
+    "How much does it cost?",
+    "What are your prices?",
+    "Can you give me a ballpark?",
+    "I am curious about your pricing.",
+])
+def test_pricing_questions_take_the_fast_path(transcript):
+    assert intents.classify(transcript).name == "pricing"
+
+
+@pytest.mark.parametrize("transcript", [
+    "How much notice do you need, can you come Tuesday morning?",
+    "How much time does the cleaning take?",
+    "Is the estimate free or does it cost anything?",
+    "I am in Katy, how much for a quote?",
+    "What are your prices? My zip is 77494.",
+])
+def test_booking_turns_go_to_the_llm(transcript):
+    assert intents.classify(transcript) is None
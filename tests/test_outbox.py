@@ -0,0 +1,110 @@
+import json
+import asyncio
+
+import pytest
+
+import outbox
+from outbox import (OutboxWorker, make_job, CLAIMS_KEY, DEAD_KEY, DONE_PREFIX, JOBS_KEY,
+                    PROCESSING_KEY, RETRY_KEY)
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+@pytest.fixture
+def redis():
+    return fakeredis.FakeAsyncRedis()
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    # Records payloads; a payload with "fail" raises like a Twilio error would
+    calls = []
+
+    async def fake_handler(payload):
+        calls.append(payload)
+        if payload.get("fail"):
+            raise RuntimeError("twilio down")
+
+    monkeypatch.setitem(outbox.HANDLERS, "test", fake_handler)
+    return calls
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def drain(worker):
+    claimed = await worker.claim()
+    if claimed:
+        await worker.deliver(claimed)
+    return claimed
+
+
+def test_claim_moves_jobs_and_records_the_claim(redis, sent):
+    async def scenario():
+        worker = OutboxWorker(redis, batch=2)
+        for sid in ("CA1", "CA2", "CA3"):
+            await redis.lpush(JOBS_KEY, make_job("test", sid, {}))
+        claimed = await worker.claim()
+        assert [json.loads(raw)["id"] for raw in claimed] == ["test:CA1", "test:CA2"]
+        assert await redis.llen(PROCESSING_KEY) == 2
+        assert set(await redis.hkeys(CLAIMS_KEY)) == {b"test:CA1", b"test:CA2"}
+        await worker.deliver(claimed)
+        assert await redis.llen(PROCESSING_KEY) == 0
+        assert await redis.hlen(CLAIMS_KEY) == 0
+        assert await redis.exists(DONE_PREFIX + "test:CA1")
+    run(scenario())
+    assert len(sent) == 2
+
+
+def test_failed_job_is_retried_then_dead_lettered(redis, sent, monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(outbox, "OUTBOX_RETRY_BASE_S", 0)
+
+    async def scenario():
+        worker = OutboxWorker(redis)
+        await redis.lpush(JOBS_KEY, make_job("test", "CA1", {"fail": True}))
+        await drain(worker)
+        retries = await redis.zrange(RETRY_KEY, 0, -1)
+        assert [json.loads(raw)["attempts"] for raw in retries] == [1]
+        # Due immediately: the sweep puts it back on the queue
+        await worker.sweep()
+        assert await redis.zcard(RETRY_KEY) == 0
+        await drain(worker)
+        dead = [json.loads(raw) for raw in await redis.lrange(DEAD_KEY, 0, -1)]
+        assert [(job["id"], job["attempts"], job["error"]) for job in dead] == [("test:CA1", 2, "twilio down")]
+        assert await redis.llen(JOBS_KEY) == await redis.zcard(RETRY_KEY) == 0
+    run(scenario())
+    assert len(sent) == 2
+
+
+def test_delivered_job_is_not_sent_again(redis, sent):
+    async def scenario():
+        worker = OutboxWorker(redis)
+        job = make_job("test", "CA1", {})
+        # Queued twice in one batch, then redelivered after the first run
+        await redis.lpush(JOBS_KEY, job, job)
+        await drain(worker)
+        await redis.lpush(JOBS_KEY, job)
+        await drain(worker)
+        assert await redis.llen(PROCESSING_KEY) == 0
+    run(scenario())
+    assert len(sent) == 1
+
+
+def test_job_orphaned_before_its_claim_is_recorded_is_requeued(redis, sent, monkeypatch):
+    async def scenario():
+        worker = OutboxWorker(redis)
+        # A worker that died right after its LMOVE
+        await redis.lpush(PROCESSING_KEY, make_job("test", "CA1", {}))
+        await worker.sweep()
+        assert await redis.hexists(CLAIMS_KEY, "test:CA1")
+        assert await redis.llen(PROCESSING_KEY) == 1
+        # Once the visibility timeout has passed it goes back on the queue
+        monkeypatch.setattr(outbox, "OUTBOX_VISIBILITY_S", -1)
+        await worker.sweep()
+        assert await redis.llen(PROCESSING_KEY) == 0
+        assert await redis.hlen(CLAIMS_KEY) == 0
+        await drain(worker)
+    run(scenario())
+    assert len(sent) == 1
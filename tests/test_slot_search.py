@@ -0,0 +1,74 @@
+import datetime
+
+import pytest
+
+from slot_search import CALENDAR_TIMEZONE, Schedule, ZipIndex
+
+# A quiet Monday; every test asks at 06:00, so the lead time allows 08:00 on
+DAY = datetime.date(2026, 3, 2)
+NOW = datetime.datetime(2026, 3, 2, 6, 0, tzinfo=CALENDAR_TIMEZONE).timestamp()
+
+
+@pytest.fixture
+def zips():
+    # 77002 is about a mile from 77001; 77090 is about 30 miles out
+    return ZipIndex(["77001", "77002", "77090"], [29.76, 29.7745, 30.195], [-95.37, -95.37, -95.37])
+
+
+def at(clock):
+    hour, minute = map(int, clock.split(":"))
+    return datetime.datetime.combine(DAY, datetime.time(hour, minute), CALENDAR_TIMEZONE)
+
+
+def event(start, end, zip_code, crew=None):
+    return at(start), at(end), zip_code, crew
+
+
+def starts(slots):
+    return [datetime.datetime.fromisoformat(slot.start).strftime("%H:%M") for slot in slots]
+
+
+def test_openings_before_and_after_an_appointment(zips):
+    schedule = Schedule.build([event("10:00", "11:00", "77001")], zips)
+    slots = schedule.best_slots("77001", now=NOW)
+    assert starts(slots) == ["09:00", "11:15"]
+    assert all(slot.zip == "77001" and slot.detour_min == 10 for slot in slots)
+
+
+def test_openings_stay_inside_the_work_day(zips):
+    schedule = Schedule.build([event("08:30", "09:30", "77001", "a"),
+                               event("16:30", "17:30", "77001", "b")], zips)
+    # 07:30 starts before the day and 17:45 would run past 18:00
+    assert starts(schedule.best_slots("77001", limit=5, now=NOW)) == ["09:45", "15:30"]
+
+
+def test_opening_must_leave_time_to_reach_the_next_appointment(zips):
+    # The crew's 11:45 job is 30 miles away: no estimate fits after 11:00
+    schedule = Schedule.build([event("10:00", "11:00", "77001", "a"),
+                               event("11:45", "12:45", "77090", "a")], zips)
+    assert starts(schedule.best_slots("77001", limit=5, now=NOW)) == ["09:00"]
+
+    # Another crew's job does not constrain this one
+    schedule = Schedule.build([event("10:00", "11:00", "77001", "a"),
+                               event("11:45", "12:45", "77090", "b")], zips)
+    assert starts(schedule.best_slots("77001", limit=5, now=NOW)) == ["09:00", "11:15"]
+
+
+def test_each_crew_is_chained_on_its_own_route(zips):
+    entries = [event("10:00", "11:00", "77001", "a"), event("12:00", "13:00", "77002", "a")]
+    # One crew: the hour between its two jobs is too short for an estimate
+    assert starts(Schedule.build(entries, zips).best_slots("77001", limit=5, now=NOW)) == ["09:00", "13:15"]
+
+    entries[1] = event("12:00", "13:00", "77002", "b")
+    assert sorted(starts(Schedule.build(entries, zips).best_slots("77001", limit=5, now=NOW))) == [
+        "09:00", "11:00", "11:15", "13:15"]
+
+
+def test_zip_missing_from_the_table_matches_appointments_at_that_zip(zips):
+    schedule = Schedule.build([event("10:00", "11:00", "77550"), event("14:00", "15:00", "77001")], zips)
+    slots = schedule.best_slots("77550", limit=5, now=NOW)
+    assert starts(slots) == ["09:00", "11:15"]
+    assert all(slot.zip == "77550" and slot.miles == 0 for slot in slots)
+    assert schedule.best_slots("77551", now=NOW) == []
+    # And an unplaceable appointment is still no anchor for a known ZIP
+    assert starts(schedule.best_slots("77001", limit=5, now=NOW)) == ["13:00", "15:15"]
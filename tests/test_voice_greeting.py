@@ -0,0 +1,23 @@
+import pytest
+
+import main
+
+
+@pytest.fixture
+def client():
+    return main.app.test_client()
+
+
+@pytest.mark.parametrize("answered_by", ["machine_start", "machine_end_beep", "fax"])
+def test_machines_are_sent_to_voicemail(client, answered_by):
+    resp = client.post("/voice-greeting", data={"CallSid": "CA-amd", "AnsweredBy": answered_by})
+    assert resp.status_code == 307
+    assert resp.headers["Location"].endswith("/voicemail")
+
+
+def test_people_get_the_greeting_and_stream(client):
+    resp = client.post("/voice-greeting", data={"CallSid": "CA-human", "AnsweredBy": "human", "From": "+15550001111"})
+    assert resp.status_code == 200
+    body = resp.get_data(as_text=True)
+    assert '<Parameter name="sid" value="CA-human" />' in body
+    assert '<Parameter name="caller" value="+15550001111" />' in body
@@ -0,0 +1,172 @@
+"""
+Content-addressed cache of synthesized speech, shared by every call (and,
+through the on-disk store, by every worker). Keys come from
+tts_pipeline.cache_key: a hash of the text and everything else that changes
+the audio (voice, model, voice settings, output format).
+
+Two tiers:
+- disk: one raw µ-law file per phrase under TTS_CACHE_DIR, size-bounded with
+  least-recently-used eviction, read back through mmap
+- memory: the most recently used mappings, bounded by TTS_CACHE_HOT_MB
+
+Hits are handed out as memoryviews over the mapping, so cached audio goes
+out to Twilio without being copied.
+"""
+import os
+import mmap
+import threading
+from collections import OrderedDict
+from metrics import registry
+from audio_engine import BASE_DIR
+
+# --- ENV VARS
+TTS_CACHE = os.environ.get("TTS_CACHE", "1") == "1"
+TTS_CACHE_DIR = os.environ.get("TTS_CACHE_DIR", os.path.join(BASE_DIR, "static", "tts_cache"))
+TTS_CACHE_MAX_MB = int(os.environ.get("TTS_CACHE_MAX_MB", 256))
+TTS_CACHE_HOT_MB = int(os.environ.get("TTS_CACHE_HOT_MB", 32))
+
+
+class TTSCache:
+    def __init__(self, cache_dir=TTS_CACHE_DIR, max_bytes=TTS_CACHE_MAX_MB << 20,
+                 hot_bytes=TTS_CACHE_HOT_MB << 20):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hot_bytes = hot_bytes
+        self.lock = threading.Lock()
+        # key -> mmap, most recently used last
+        self.hot = OrderedDict()
+        self.hot_size = 0
+        # key -> file size, least recently used first; merged with the files on disk at the first write
+        self.index = OrderedDict()
+        self.disk_size = 0
+        self.scanned = False
+
+    def get_hot(self, key):
+        """Memory tier only: never touches the disk, so it is safe on the event loop."""
+        with self.lock:
+            mapped = self.hot.get(key)
+            if mapped is None:
+                return None
+            self.hot.move_to_end(key)
+            self._touch(key)
+        registry.inc("voice_tts_cache_total", result="hit_memory")
+        return memoryview(mapped)
+
+    def get(self, key):
+        """Returns a memoryview of the cached audio, or None. Opens the file on a memory miss; call from an executor."""
+        cached = self.get_hot(key)
+        if cached is not None:
+            return cached
+        # Mapped outside the lock, so lookups on the event loop never wait for the disk
+        mapped = self._map(key)
+        if mapped is None:
+            registry.inc("voice_tts_cache_total", result="miss")
+            return None
+        with self.lock:
+            self._touch(key, len(mapped))
+            if key not in self.hot:
+                self._hold(key, mapped)
+        registry.inc("voice_tts_cache_total", result="hit_disk")
+        return memoryview(mapped)
+
+    def put(self, key, ulaw):
+        # Blocking file write; call from an executor
+        if not ulaw:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(ulaw)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"[TTS CACHE] Failed to store {key[:12]}: {e}")
+            return
+        with self.lock:
+            self._scan()
+            self._touch(key, len(ulaw))
+            self._evict()
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.index), "disk_bytes": self.disk_size, "hot_bytes": self.hot_size}
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.ulaw")
+
+    def _map(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # Missing, or empty (mmap refuses zero-length files)
+            return None
+
+    def _hold(self, key, mapped):
+        self.hot[key] = mapped
+        self.hot_size += len(mapped)
+        while self.hot_size > self.hot_bytes and len(self.hot) > 1:
+            _, old = self.hot.popitem(last=False)
+            self.hot_size -= len(old)
+            # Views handed out earlier keep the mapping alive; it is unmapped once they go
+
+    def _touch(self, key, size=None):
+        if key in self.index:
+            self.index.move_to_end(key)
+        elif size is not None:
+            self.index[key] = size
+            self.disk_size += size
+
+    def _scan(self):
+        # First write: pick up what earlier runs and sibling workers left on disk, oldest first
+        if self.scanned:
+            return
+        self.scanned = True
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".ulaw"):
+                    try:
+                        st = os.stat(os.path.join(root, name))
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, name[:-5], st.st_size))
+        known = dict(self.index)
+        self.index.clear()
+        self.disk_size = 0
+        for _, key, size in sorted(entries):
+            if key not in known:
+                self.index[key] = size
+                self.disk_size += size
+        for key, size in known.items():
+            self.index[key] = size
+            self.disk_size += size
+
+    def _evict(self):
+        while self.disk_size > self.max_bytes and len(self.index) > 1:
+            key, size = self.index.popitem(last=False)
+            self.disk_size -= size
+            mapped = self.hot.pop(key, None)
+            if mapped is not None:
+                self.hot_size -= len(mapped)
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+
+tts_cache = TTSCache()
+
+
+def _collect_tts_cache():
+    stats = tts_cache.stats()
+    yield "voice_tts_cache_entries", "gauge", {}, stats["entries"]
+    yield "voice_tts_cache_bytes", "gauge", {"tier": "disk"}, stats["disk_bytes"]
+    yield "voice_tts_cache_bytes", "gauge", {"tier": "memory"}, stats["hot_bytes"]
+
+
+registry.describe("voice_tts_cache_total", "TTS phrase cache lookups by result")
+registry.describe("voice_tts_cache_entries", "Phrases in the TTS cache known to this worker")
+registry.describe("voice_tts_cache_bytes", "Bytes held by the TTS cache, by tier")
+registry.add_collector(_collect_tts_cache)
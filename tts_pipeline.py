@@ -0,0 +1,236 @@
+import os
+import re
+import asyncio
+import hashlib
+import httpx
+from tts_cache import tts_cache, TTS_CACHE
+from upstreams import make_http_client
+
+# --- ENV VARS
+ELEVENLABS_API_KEY = os.environ.get("ELEVENLABS_API_KEY")
+ELEVENLABS_VOICE_ID = os.environ.get("ELEVENLABS_VOICE_ID")
+ELEVENLABS_API_URL = os.environ.get("ELEVENLABS_API_URL", "https://api.elevenlabs.io")
+ELEVENLABS_MODEL_ID = "eleven_multilingual_v2"
+ELEVENLABS_VOICE_SETTINGS = {"stability": 0.5, "similarity_boost": 0.7}
+# Twilio-native audio, so synthesized speech goes out without transcoding
+ELEVENLABS_OUTPUT_FORMAT = "ulaw_8000"
+TTS_MAX_CONCURRENCY = int(os.environ.get("TTS_MAX_CONCURRENCY", 3))
+# Phrases streamed from the LLM can carry what the caller said (names, streets),
+# so they are kept out of the shared cache unless this is turned on
+TTS_CACHE_LLM_PHRASES = os.environ.get("TTS_CACHE_LLM_PHRASES", "0") == "1"
+
+# Numbers in a reply are phone numbers, addresses and dates: never cached
+_HAS_DIGITS = re.compile(r"\d")
+
+# Phrase boundaries: a sentence end always flushes, a clause break only once
+# the phrase is long enough to sound natural on its own.
+SENTENCE_END = re.compile(r'[.!?]+["\')\]]*\s+')
+CLAUSE_BREAK = re.compile(r'[,;:—]\s+')
+MIN_CLAUSE_CHARS = 40
+FIRST_CLAUSE_CHARS = 20
+MAX_PHRASE_CHARS = 200
+
+_http_client = None
+
+
+def get_http_client():
+    # One pooled keep-alive client per process, shared by every call
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = make_http_client()
+    return _http_client
+
+
+def tts_request(text):
+    url = (f"{ELEVENLABS_API_URL}/v1/text-to-speech/{ELEVENLABS_VOICE_ID}/stream"
+           f"?output_format={ELEVENLABS_OUTPUT_FORMAT}")
+    headers = {
+        "xi-api-key": ELEVENLABS_API_KEY,
+        "Content-Type": "application/json"
+    }
+    body = {
+        "text": text,
+        "voice_settings": ELEVENLABS_VOICE_SETTINGS,
+        "model_id": ELEVENLABS_MODEL_ID
+    }
+    return url, headers, body
+
+
+def cache_key(text):
+    # Everything that changes the audio for a given text
+    params = (text.strip(), ELEVENLABS_VOICE_ID, ELEVENLABS_MODEL_ID,
+              sorted(ELEVENLABS_VOICE_SETTINGS.items()), ELEVENLABS_OUTPUT_FORMAT)
+    return hashlib.sha256(repr(params).encode()).hexdigest()
+
+
+def synthesize_ulaw(text):
+    # Whole-utterance synthesis for audio rendered ahead of time (blocking)
+    url, headers, body = tts_request(text)
+    resp = httpx.post(url, headers=headers, json=body, timeout=30.0)
+    resp.raise_for_status()
+    return resp.content
+
+
+class PhraseChunker:
+    """Groups streamed LLM deltas into sentence/clause sized phrases for TTS."""
+
+    def __init__(self):
+        self.buf = ""
+        self.emitted = 0
+
+    def feed(self, delta):
+        self.buf += delta
+        phrases = []
+        while True:
+            phrase = self._next_phrase()
+            if not phrase:
+                break
+            phrases.append(phrase)
+        return phrases
+
+    def flush(self):
+        phrase = self.buf.strip()
+        self.buf = ""
+        if phrase:
+            self.emitted += 1
+            return [phrase]
+        return []
+
+    def _next_phrase(self):
+        cut = None
+        match = SENTENCE_END.search(self.buf)
+        if match:
+            cut = match.end()
+        else:
+            min_chars = FIRST_CLAUSE_CHARS if self.emitted == 0 else MIN_CLAUSE_CHARS
+            for match in CLAUSE_BREAK.finditer(self.buf):
+                if match.end() >= min_chars:
+                    cut = match.end()
+                    break
+        if cut is None and len(self.buf) > MAX_PHRASE_CHARS:
+            cut = self.buf.rfind(" ", 0, MAX_PHRASE_CHARS) + 1 or MAX_PHRASE_CHARS
+        if cut is None:
+            return None
+        phrase, self.buf = self.buf[:cut].strip(), self.buf[cut:]
+        if not phrase:
+            return None
+        self.emitted += 1
+        return phrase
+
+
+class TTSPipeline:
+    """
+    Streams one assistant reply to the caller: phrases are synthesized
+    concurrently on the shared HTTP client and played back in order. Fixed
+    wording (say, the fixed parts of say_parts) is served from the TTS cache
+    once it has been heard; LLM phrases only with TTS_CACHE_LLM_PHRASES.
+    """
+
+    def __init__(self, send_audio, http_client=None, gate=None, prefetch=None, on_first_byte=None):
+        # With a gate, nothing is played (and only `prefetch` phrases are
+        # synthesized) until the gate opens
+        self.send_audio = send_audio
+        self.on_first_byte = on_first_byte
+        self.gate = gate
+        self.prefetch = prefetch
+        self.http = http_client or get_http_client()
+        self.chunker = PhraseChunker()
+        self.sem = asyncio.Semaphore(TTS_MAX_CONCURRENCY)
+        self.order = asyncio.Queue()
+        self.synth_tasks = []
+        self.player = asyncio.create_task(self._play())
+
+    def feed(self, delta):
+        for phrase in self.chunker.feed(delta):
+            self._submit_generated(phrase)
+
+    def say(self, text):
+        # Queue a complete utterance (fixed wording) after whatever has been fed so far
+        for phrase in self.chunker.flush():
+            self._submit_generated(phrase)
+        chunker = PhraseChunker()
+        for phrase in chunker.feed(text) + chunker.flush():
+            self._submit(phrase, cacheable=True)
+
+    def say_parts(self, parts):
+        # Queue an utterance stitched from (text, cacheable) parts: fixed wording
+        # is served from the cache, dynamic slots (address, date) synthesized fresh
+        for phrase in self.chunker.flush():
+            self._submit_generated(phrase)
+        for text, cacheable in parts:
+            if text.strip():
+                self._submit(text.strip(), cacheable)
+
+    async def finish(self):
+        for phrase in self.chunker.flush():
+            self._submit_generated(phrase)
+        self.order.put_nowait(None)
+        await self.player
+
+    def _submit_generated(self, phrase):
+        self._submit(phrase, cacheable=TTS_CACHE_LLM_PHRASES and not _HAS_DIGITS.search(phrase))
+
+    async def cancel(self):
+        tasks = self.synth_tasks + [self.player]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _submit(self, phrase, cacheable=False):
+        audio_q = asyncio.Queue()
+        index = len(self.synth_tasks)
+        self.synth_tasks.append(asyncio.create_task(self._synthesize(phrase, audio_q, index, cacheable)))
+        self.order.put_nowait(audio_q)
+
+    def _first_byte(self):
+        if self.on_first_byte:
+            callback, self.on_first_byte = self.on_first_byte, None
+            callback()
+
+    async def _synthesize(self, text, audio_q, index, cacheable=False):
+        key = cache_key(text) if TTS_CACHE and cacheable else None
+        try:
+            cached = None
+            if key:
+                cached = tts_cache.get_hot(key)
+                if cached is None:
+                    # Not in memory: opening and mapping the file happens off the event loop
+                    cached = await asyncio.get_running_loop().run_in_executor(None, tts_cache.get, key)
+            if cached is not None:
+                # A hit costs nothing, so it is not held back by the gate
+                self._first_byte()
+                audio_q.put_nowait(cached)
+                return
+            if self.gate and self.prefetch is not None and index >= self.prefetch:
+                await self.gate.wait()
+            url, headers, body = tts_request(text)
+            chunks = [] if key else None
+            async with self.sem:
+                async with self.http.stream("POST", url, headers=headers, json=body) as resp:
+                    resp.raise_for_status()
+                    async for chunk in resp.aiter_bytes():
+                        if chunk:
+                            self._first_byte()
+                            audio_q.put_nowait(chunk)
+                            if chunks is not None:
+                                chunks.append(chunk)
+            if chunks:
+                # Only complete phrases are stored; the write happens off the event loop
+                asyncio.get_running_loop().run_in_executor(None, tts_cache.put, key, b"".join(chunks))
+        except Exception as e:
+            print(f"[TTS] ElevenLabs request failed for {text!r}: {e}")
+        finally:
+            audio_q.put_nowait(None)
+
+    async def _play(self):
+        if self.gate:
+            await self.gate.wait()
+        while True:
+            audio_q = await self.order.get()
+            if audio_q is None:
+                return
+            while True:
+                chunk = await audio_q.get()
+                if chunk is None:
+                    break
+                await self.send_audio(chunk)
@@ -0,0 +1,276 @@
+"""
+Warm upstream connections, so a call's first reply does not pay for TLS
+handshakes and session setup:
+
+- AssemblyAI: a small pool of open realtime sessions per worker, plus one
+  session pre-opened per CallSid as soon as /voice-greeting answers (the
+  greeting plays while it connects). process_media_stream picks it up by SID.
+- OpenAI / ElevenLabs: keep-alive httpx clients (HTTP/2 when the optional
+  h2 package is installed), touched periodically so pooled connections stay
+  open between calls.
+
+Idle and reserved sessions are kept alive with a little µ-law silence,
+replaced when they close, and recycled after UPSTREAM_ASR_MAX_AGE_S. With
+several worker processes the media stream may land on a different worker
+than the webhook; it then takes a session from that worker's pool instead
+and announces the claim over Redis, so the worker holding the reservation
+hands it back to its pool (or closes it) rather than paying for it until
+UPSTREAM_RESERVE_TTL_S.
+"""
+import os
+import time
+import asyncio
+import importlib.util
+from collections import deque
+import httpx
+import websockets
+from metrics import registry
+from session_store import get_async_redis, REDIS_URL
+
+# --- ENV VARS
+ASSEMBLYAI_API_KEY = os.environ.get("ASSEMBLYAI_API_KEY")
+ASSEMBLYAI_REALTIME_URL = os.environ.get("ASSEMBLYAI_REALTIME_URL", "wss://api.assemblyai.com/v2/realtime/ws")
+# Open sessions kept ready per worker (each is billed while open)
+UPSTREAM_ASR_POOL = int(os.environ.get("UPSTREAM_ASR_POOL", 1))
+UPSTREAM_ASR_MAX_RESERVED = int(os.environ.get("UPSTREAM_ASR_MAX_RESERVED", 20))
+# A reservation whose media stream never arrives is closed after this long
+UPSTREAM_RESERVE_TTL_S = int(os.environ.get("UPSTREAM_RESERVE_TTL_S", 30))
+UPSTREAM_ASR_MAX_AGE_S = int(os.environ.get("UPSTREAM_ASR_MAX_AGE_S", 120))
+UPSTREAM_KEEPALIVE_S = float(os.environ.get("UPSTREAM_KEEPALIVE_S", 5))
+UPSTREAM_HTTP_PING_S = int(os.environ.get("UPSTREAM_HTTP_PING_S", 30))
+
+# Twilio's µ-law goes to AssemblyAI as is
+ASR_URL = f"{ASSEMBLYAI_REALTIME_URL}?sample_rate=8000&encoding=pcm_mulaw"
+HTTP2 = importlib.util.find_spec("h2") is not None
+KEEPALIVE_AUDIO = b"\xff" * 800
+# Call SIDs whose media stream was taken by a worker without a reservation for it
+CLAIMED_CHANNEL = "upstreams:asr:claimed"
+
+registry.describe("voice_upstream_asr_sessions_total", "AssemblyAI sessions handed to calls, by where they came from")
+registry.describe("voice_upstream_asr_reservations_total",
+                  "Per-call AssemblyAI reservations by how they ended (used, claimed elsewhere, expired)")
+registry.describe("voice_upstream_asr_idle", "Open AssemblyAI sessions waiting in this worker's pool")
+registry.describe("voice_upstream_asr_reserved", "AssemblyAI sessions pre-opened for a CallSid")
+
+
+def make_http_client(max_connections=50):
+    # Shared settings for the long-lived upstream clients
+    return httpx.AsyncClient(
+        http2=HTTP2,
+        timeout=httpx.Timeout(15.0, connect=5.0),
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=20,
+                            keepalive_expiry=UPSTREAM_HTTP_PING_S * 3),
+    )
+
+
+class AsrSession:
+    def __init__(self, task):
+        self.task = task
+        self.created = time.monotonic()
+        self.last_keepalive = self.created
+
+    def ws(self):
+        if self.task.done() and not self.task.cancelled() and self.task.exception() is None:
+            return self.task.result()
+        return None
+
+    def healthy(self):
+        ws = self.ws()
+        return ws is not None and not ws.closed and time.monotonic() - self.created < UPSTREAM_ASR_MAX_AGE_S
+
+    async def close(self):
+        if not self.task.done():
+            self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        ws = self.ws()
+        if ws is not None:
+            await ws.close()
+
+
+class UpstreamManager:
+    def __init__(self, pool_size=UPSTREAM_ASR_POOL, max_reserved=UPSTREAM_ASR_MAX_RESERVED):
+        self.pool_size = pool_size
+        self.max_reserved = max_reserved
+        self.loop = None
+        self.task = None
+        self.listener = None
+        self.idle = deque()
+        self.reserved = {}
+        self.http_targets = []
+        self.last_http_ping = 0.0
+
+    def start(self, http_targets=()):
+        # http_targets: (get_client, url) pairs touched to keep pooled connections warm
+        self.loop = asyncio.get_running_loop()
+        self.http_targets = list(http_targets)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._maintain())
+        if REDIS_URL and (self.listener is None or self.listener.done()):
+            self.listener = asyncio.create_task(self._listen_claims())
+        return self
+
+    async def stop(self):
+        for task in (self.task, self.listener):
+            if task:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self.task = self.listener = None
+        sessions = list(self.idle) + list(self.reserved.values())
+        self.idle.clear()
+        self.reserved.clear()
+        await asyncio.gather(*[s.close() for s in sessions], return_exceptions=True)
+
+    async def warm(self, timeout=5.0):
+        # Startup: open the ASR pool and the HTTP connections before traffic arrives
+        try:
+            await asyncio.wait_for(self._check(), timeout)
+            opening = [s.task for s in self.idle if not s.task.done()]
+            if opening:
+                await asyncio.wait(opening, timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"[UPSTREAM] Warm-up still incomplete after {timeout}s; continuing")
+
+    def reserve(self, sid):
+        """Pre-opens upstream sessions for a call. Thread-safe; returns at once."""
+        if self.loop is not None and sid:
+            self.loop.call_soon_threadsafe(self._reserve, sid)
+
+    def _reserve(self, sid):
+        if sid in self.reserved or len(self.reserved) >= self.max_reserved:
+            return
+        session = self._pop_idle() or AsrSession(asyncio.create_task(self._open()))
+        session.created = time.monotonic()
+        self.reserved[sid] = session
+        if time.monotonic() - self.last_http_ping > UPSTREAM_HTTP_PING_S / 2:
+            asyncio.create_task(self._ping_http())
+
+    async def acquire_asr(self, sid):
+        """An open AssemblyAI realtime session for this call; the caller closes it."""
+        session = self.reserved.pop(sid, None)
+        if session is not None:
+            registry.inc("voice_upstream_asr_reservations_total", result="used")
+            await asyncio.gather(session.task, return_exceptions=True)
+            if session.healthy():
+                registry.inc("voice_upstream_asr_sessions_total", source="reserved")
+                return session.ws()
+            await session.close()
+        elif REDIS_URL:
+            # The webhook may have reserved a session on another worker: let it go
+            asyncio.create_task(self._announce_claim(sid))
+        session = self._pop_idle()
+        if session is not None:
+            registry.inc("voice_upstream_asr_sessions_total", source="pooled")
+            return session.ws()
+        registry.inc("voice_upstream_asr_sessions_total", source="cold")
+        return await self._open()
+
+    def _release(self, session):
+        # A reservation nobody will use: top up the idle pool with it, or close it
+        if session.healthy() and len(self.idle) < self.pool_size:
+            self.idle.append(session)
+        else:
+            asyncio.create_task(session.close())
+
+    async def _announce_claim(self, sid):
+        try:
+            await get_async_redis().publish(CLAIMED_CHANNEL, sid)
+        except Exception as e:
+            print(f"[UPSTREAM] Failed to announce claimed call {sid}: {e}")
+
+    async def _listen_claims(self):
+        while True:
+            pubsub = None
+            try:
+                pubsub = get_async_redis().pubsub()
+                await pubsub.subscribe(CLAIMED_CHANNEL)
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    data = message["data"]
+                    session = self.reserved.pop(data.decode() if isinstance(data, bytes) else data, None)
+                    if session is not None:
+                        registry.inc("voice_upstream_asr_reservations_total", result="claimed_elsewhere")
+                        self._release(session)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[UPSTREAM] Claim listener error, resubscribing: {e}")
+                await asyncio.sleep(5)
+            finally:
+                if pubsub is not None:
+                    await asyncio.shield(pubsub.aclose())
+
+    def _pop_idle(self):
+        while self.idle:
+            session = self.idle.popleft()
+            if session.healthy():
+                return session
+            asyncio.create_task(session.close())
+        return None
+
+    async def _open(self):
+        return await websockets.connect(ASR_URL, extra_headers={"Authorization": ASSEMBLYAI_API_KEY})
+
+    async def _maintain(self):
+        while True:
+            try:
+                await self._check()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[UPSTREAM] Maintenance error: {e}")
+            await asyncio.sleep(1.0)
+
+    async def _check(self):
+        now = time.monotonic()
+        # Reservations nobody picked up, and sessions that died or aged out
+        for sid, session in list(self.reserved.items()):
+            if now - session.created > UPSTREAM_RESERVE_TTL_S or (session.task.done() and not session.healthy()):
+                del self.reserved[sid]
+                registry.inc("voice_upstream_asr_reservations_total", result="expired")
+                self._release(session)
+        for session in list(self.idle):
+            if session.task.done() and not session.healthy():
+                self.idle.remove(session)
+                asyncio.create_task(session.close())
+        opening = sum(1 for s in self.idle if not s.task.done())
+        while len(self.idle) < self.pool_size and opening < self.pool_size:
+            self.idle.append(AsrSession(asyncio.create_task(self._open())))
+            opening += 1
+        # Silence keeps the open sessions from timing out
+        for session in list(self.idle) + list(self.reserved.values()):
+            ws = session.ws()
+            if ws is not None and not ws.closed and now - session.last_keepalive >= UPSTREAM_KEEPALIVE_S:
+                session.last_keepalive = now
+                try:
+                    await ws.send(KEEPALIVE_AUDIO)
+                except websockets.ConnectionClosed:
+                    pass
+        if self.http_targets and now - self.last_http_ping >= UPSTREAM_HTTP_PING_S:
+            await self._ping_http()
+
+    async def _ping_http(self):
+        self.last_http_ping = time.monotonic()
+
+        async def ping(get_client, url):
+            try:
+                # Any response will do: the point is an open, warm connection in the pool
+                await get_client().head(url)
+            except httpx.HTTPError as e:
+                print(f"[UPSTREAM] Warm-up request to {url} failed: {e}")
+        await asyncio.gather(*[ping(get_client, url) for get_client, url in self.http_targets])
+
+    def stats(self):
+        return {"idle": sum(1 for s in self.idle if s.healthy()), "reserved": len(self.reserved)}
+
+
+upstreams = UpstreamManager()
+
+
+def _collect_upstreams():
+    stats = upstreams.stats()
+    yield "voice_upstream_asr_idle", "gauge", {}, stats["idle"]
+    yield "voice_upstream_asr_reserved", "gauge", {}, stats["reserved"]
+
+
+registry.add_collector(_collect_upstreams)